@@ -0,0 +1,103 @@
+from pathlib import Path
+import random
+import string
+import timeit
+import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from modules.browser import DepthResponse, OrdersResponse, PortfolioResponse
+
+# decode and encode time of stdlib json, orjson and msgspec on payloads sized like the api responses
+# run: python benchmarks/bench_codec.py (backends that are not installed are skipped)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def random_text(length: int = 12):
+    return "".join(random.choices(string.ascii_letters, k=length))
+
+
+def random_fields(amount: int):
+    return {
+        f"field{index}": random.choice([random_text(), random.random(), random.randint(0, 10**9), None])
+        for index in range(amount)
+    }
+
+
+depth = {"errno": 0, "errmsg": "", "result": {
+    "asks": [[f"{random.random():.3f}", f"{random.random() * 1e4:.2f}"] for _ in range(150)],
+    "bids": [[f"{random.random():.3f}", f"{random.random() * 1e4:.2f}"] for _ in range(150)],
+    "symbol": random_text(40),
+    "question_id": random_text(64),
+}}
+orders = {"errno": 0, "errmsg": "", "result": {"total": 100, "list": [
+    {
+        **random_fields(35),
+        "transNo": random_text(20), "side": 1, "outcomeSide": 1, "price": "0.55", "filled": "10/10",
+        "totalPrice": "5.5", "topicTitle": random_text(40), "mutilTitle": random_text(30),
+    }
+    for _ in range(100)
+]}}
+portfolio = {"errno": 0, "errmsg": "", "result": {"total": 100, "list": [
+    {
+        **random_fields(30),
+        "topicId": 1, "mutilTopicId": 0, "topicTitle": random_text(40), "mutilTitle": "", "tokenId": random_text(70),
+        "tokenAmount": "12.5", "value": "6.1", "outcome": "YES", "outcomeSide": 1,
+    }
+    for _ in range(100)
+]}}
+modules_db = {
+    random_text(140): {
+        "address": "0x" + random_text(40),
+        "label": random_text(10),
+        "proxy": None,
+        "modules": [{"module_name": "opinion", "status": "to_run"} for _ in range(5)],
+    }
+    for _ in range(10000)
+}
+
+
+def bench_decode(name: str, payload: dict, response_type: type = None, number: int = 200):
+    body = json.dumps(payload).encode()
+    decoders = {"json": json.loads}
+    if orjson:
+        decoders["orjson"] = orjson.loads
+    if msgspec:
+        decoders["msgspec"] = msgspec.json.decode
+        if response_type:
+            decoders["msgspec typed"] = msgspec.json.Decoder(response_type).decode
+
+    results = "  ".join(
+        f"{backend} {round(timeit.timeit(lambda: decode(body), number=number) / number * 1e3, 3)}ms"
+        for backend, decode in decoders.items()
+    )
+    print(f"{name:<14}{round(len(body) / 1024, 1):>8} KB decode  {results}")
+
+
+def bench_encode(name: str, payload: dict, number: int = 20):
+    encoders = {"json": json.dumps}
+    if orjson:
+        encoders["orjson"] = orjson.dumps
+    if msgspec:
+        encoders["msgspec"] = msgspec.json.encode
+
+    results = "  ".join(
+        f"{backend} {round(timeit.timeit(lambda: encode(payload), number=number) / number * 1e3, 2)}ms"
+        for backend, encode in encoders.items()
+    )
+    print(f"{name:<14}{'':>11} encode  {results}")
+
+
+bench_decode("depth", depth, DepthResponse, 2000)
+bench_decode("orders", orders, OrdersResponse, 500)
+bench_decode("portfolio", portfolio, PortfolioResponse, 500)
+bench_decode("modules.json", modules_db, number=5)
+bench_encode("modules.json", modules_db)
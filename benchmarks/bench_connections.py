@@ -0,0 +1,88 @@
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.x509.oid import NameOID
+from cryptography import x509
+from aiohttp import web, ClientSession
+from tempfile import TemporaryDirectory
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+import statistics
+import asyncio
+import ssl
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from modules.utils import get_connector, close_connectors
+
+# request latency against a local TLS server: connector per session (before) vs shared pool (after)
+# run: python benchmarks/bench_connections.py
+
+MODULES = 50
+REQUESTS = 6
+PORT = 8443
+
+
+def make_ssl_contexts(folder: str):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(datetime.now() - timedelta(days=1))
+        .not_valid_after(datetime.now() + timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_name, key_name = f'{folder}/cert.pem', f'{folder}/key.pem'
+    with open(cert_name, 'wb') as f: f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_name, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(cert_name, key_name)
+    return server_context, ssl.create_default_context(cafile=cert_name)
+
+
+async def run_module(shared: bool, client_context: ssl.SSLContext, latencies: list):
+    if shared:
+        session = ClientSession(connector=get_connector(), connector_owner=False)
+    else:
+        session = ClientSession()
+
+    for _ in range(REQUESTS):
+        started = perf_counter()
+        response = await session.get(f"https://localhost:{PORT}/api", ssl=client_context)
+        await response.read()
+        latencies.append(perf_counter() - started)
+    await session.close()
+
+
+async def main():
+    with TemporaryDirectory() as folder:
+        server_context, client_context = make_ssl_contexts(folder)
+
+        app = web.Application()
+        app.router.add_get("/api", lambda request: web.json_response({"errno": 0, "result": {}}))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "localhost", PORT, ssl_context=server_context).start()
+
+        for shared in [False, True]:
+            latencies = []
+            for _ in range(MODULES):
+                await run_module(shared, client_context, latencies)
+            print(
+                f'{"shared pool" if shared else "per-session connector"}: '
+                f'mean {round(statistics.mean(latencies) * 1e3, 2)} ms/request, '
+                f'first request of module {round(statistics.mean(latencies[::REQUESTS]) * 1e3, 2)} ms'
+            )
+
+        await close_connectors()
+        await runner.cleanup()
+
+
+asyncio.run(main())
@@ -0,0 +1,61 @@
+from pathlib import Path
+import tracemalloc
+import random
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from modules.tasks import Account, ModulesQueue
+
+# memory of pending modules: one dict per module (before) vs ModulesQueue (after)
+# run: python benchmarks/bench_modules_queue.py
+
+
+def make_db(accounts_amount: int, modules_amount: int):
+    return {
+        f"gAAAAA{index:0100d}": {
+            "address": f"0x{index:040x}",
+            "label": f"{index}",
+            "proxy": None,
+            "modules": [{"module_name": random.choice(["opinion", "sell"]), "status": "to_run"} for _ in range(modules_amount)],
+        }
+        for index in range(accounts_amount)
+    }
+
+
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+for modules_total in [10_000, 100_000]:
+    modules_db = make_db(modules_total // 10, 10)
+
+    dicts, dicts_size = measure(lambda: [
+        {
+            "encoded_privatekey": encoded_pk,
+            "proxy": account_data["proxy"],
+            "address": account_data["address"],
+            "label": account_data["label"],
+            "module_info": {**module_info},
+            "last": index + 1 == len(account_data["modules"]),
+        }
+        for encoded_pk, account_data in modules_db.items()
+        for index, module_info in enumerate(account_data["modules"])
+    ])
+    del dicts
+
+    def build_queue():
+        queue = ModulesQueue()
+        for encoded_pk, account_data in modules_db.items():
+            queue.add_account(
+                Account(encoded_pk, account_data["address"], account_data["proxy"], account_data["label"]),
+                [module_info["module_name"] for module_info in account_data["modules"]],
+            )
+        return queue
+
+    queue, queue_size = measure(build_queue)
+    assert len(queue) == modules_total
+    print(f'{modules_total} modules: list of dicts {round(dicts_size / 1e6, 2)} MB, queue {round(queue_size / 1e6, 2)} MB')
@@ -1,28 +1,31 @@
+from cryptography.fernet import Fernet
 from random import randint
 from loguru import logger
 from time import sleep
+import multiprocessing
 import asyncio
 import os
 
 from modules import *
-from modules.utils import async_sleep
+from modules.utils import async_sleep, close_connectors
+from modules.browser import book_cache, topic_cache, market_scanner
 from modules.retry import DataBaseError, SoftError
-from settings import THREADS, SLEEP_AFTER_ACCOUNT, SLEEP_BETWEEN_THREADS
+from settings import THREADS, PROCESSES, DATABASE_ENGINE, DATABASE_LEASES, SLEEP_AFTER_ACCOUNT, SLEEP_BETWEEN_THREADS
 
 
 
-def initialize_account(module_data: dict, group_data: dict = None):
+def initialize_account(account: Account, group: GroupTask = None):
     browser = Browser(
-        proxy=module_data['proxy'],
-        address=module_data['address'],
+        proxy=account.proxy,
+        address=account.address,
         db=db,
     )
     wallet = Wallet(
-        privatekey=module_data["privatekey"],
-        encoded_pk=module_data["encoded_privatekey"],
+        privatekey=db.get_privatekey(encoded_pk=account.encoded_privatekey, address=account.address),
+        encoded_pk=account.encoded_privatekey,
         db=db,
     )
-    opinion = Opinion(wallet=wallet, browser=browser, label=module_data["label"], group_data=group_data)
+    opinion = Opinion(wallet=wallet, browser=browser, label=account.label, group=group)
     if browser.proxy:
         opinion.log_message(f'Got proxy <white>{browser.proxy}</white>')
     else:
@@ -46,125 +49,191 @@ async def thread_sleep(label: str, sleep_history: list):
 
 async def run_modules(
         mode: int,
-        module_data: dict,
-        sem: asyncio.Semaphore,
+        module_task: ModuleTask,
         sleep_history: list,
 ):
-    async with address_locks[module_data["address"]]:
-        async with sem:
-            await thread_sleep(module_data["label"], sleep_history)
-
-            try:
-                opinion = initialize_account(module_data)
-                module_data["module_info"]["status"] = await opinion.run(mode=mode)
-
-            except DataBaseError:
-                module_data = None
-                raise
-
-            except Exception as err:
-                logger.error(f'[-] Soft | {opinion.wallet.address} | Global error: {err}')
-                await db.append_report(encoded_pk=module_data["encoded_privatekey"], text=str(err), success=False)
-
-            finally:
-                if type(module_data) == dict:
-                    await opinion.browser.close_sessions()
-                    if mode  == 1:
-                        last_module = await db.remove_module(module_data)
-                    else:
-                        last_module = await db.remove_account(module_data)
+    await thread_sleep(module_task.label, sleep_history)
+
+    opinion = None
+    try:
+        opinion = initialize_account(module_task.account)
+        module_task.status = await opinion.run(mode=mode)
+
+    except DataBaseError:
+        module_task = None
+        raise
+
+    except asyncio.CancelledError:
+        # lease is lost or soft is stopped, module result must not be saved
+        module_task = None
+        if opinion:
+            await opinion.browser.close_sessions()
+        raise
 
-                    reports = await db.get_account_reports(
-                        key=module_data["encoded_privatekey"],
-                        address=module_data["address"],
-                        label=module_data["label"],
-                        last_module=last_module,
-                        mode=mode,
-                    )
-                    await TgReport().send_log(logs=reports)
+    except Exception as err:
+        logger.error(f'[-] Soft | {opinion.wallet.address} | Global error: {err}')
+        await db.append_report(encoded_pk=module_task.encoded_privatekey, text=str(err), success=False)
 
-                    await async_sleep(randint(*SLEEP_AFTER_ACCOUNT))
+    finally:
+        if module_task is not None:
+            await opinion.browser.close_sessions()
+            if mode  == 1:
+                last_module = await db.remove_module(module_task)
+            else:
+                last_module = await db.remove_account(module_task)
+
+            reports = await db.get_account_reports(
+                key=module_task.encoded_privatekey,
+                address=module_task.address,
+                label=module_task.label,
+                last_module=last_module,
+                mode=mode,
+            )
+            await TgReport().send_log(logs=reports)
+
+            await async_sleep(randint(*SLEEP_AFTER_ACCOUNT))
 
 
 async def run_pair(
         mode: int,
-        group_data: dict,
-        sem: asyncio.Semaphore,
+        group: GroupTask,
         sleep_history: list,
 ):
-    async with MultiLock([wallet_data["address"] for wallet_data in group_data["wallets_data"]]):
-        async with sem:
-            await thread_sleep(f"Group {group_data['group_number']}", sleep_history)
-
-            try:
-                opinion_accounts = [
-                    initialize_account(wallet_data, group_data=group_data)
-                    for wallet_data in group_data["wallets_data"]
-                ]
-                group_data["module_info"]["status"] = await PairAccounts(
-                    accounts=opinion_accounts,
-                    group_data=group_data
-                ).run()
-
-            except Exception as err:
-                logger.error(f'[-] Group {group_data["group_number"]} | Global error | {err}')
-                await db.append_report(encoded_pk=group_data["group_index"], text=str(err), success=False)
-
-            finally:
-                for opinion in opinion_accounts:
-                    await opinion.browser.close_sessions()
-
-                await db.remove_group(group_data=group_data)
-
-                reports = await db.get_account_reports(
-                    key=group_data["group_index"],
-                    label=f"Group {group_data['group_number']}",
-                    last_module=False,
-                    mode=mode,
-                )
-                await TgReport().send_log(logs=reports)
-
-                if group_data["module_info"]["status"] is True:
-                    to_sleep = randint(*SLEEP_AFTER_ACCOUNT)
-                    logger.opt(colors=True).debug(f'[•] <white>Group {group_data["group_number"]}</white> | Sleep {to_sleep}s')
-                    await async_sleep(to_sleep)
-                else:
-                    await async_sleep(10)
+    await thread_sleep(f"Group {group.group_number}", sleep_history)
+
+    opinion_accounts = []
+    try:
+        opinion_accounts = [
+            initialize_account(account, group=group)
+            for account in group.wallets
+        ]
+        group.status = await PairAccounts(
+            accounts=opinion_accounts,
+            group=group
+        ).run()
+
+    except Exception as err:
+        logger.error(f'[-] Group {group.group_number} | Global error | {err}')
+        await db.append_report(encoded_pk=group.group_index, text=str(err), success=False)
+
+    except asyncio.CancelledError:
+        # lease is lost or soft is stopped, group result must not be saved
+        for opinion in opinion_accounts:
+            await opinion.browser.close_sessions()
+        group = None
+        raise
+
+    finally:
+        if group is not None:
+            for opinion in opinion_accounts:
+                await opinion.browser.close_sessions()
+
+            await db.remove_group(group_task=group)
+
+            reports = await db.get_account_reports(
+                key=group.group_index,
+                label=f"Group {group.group_number}",
+                last_module=False,
+                mode=mode,
+            )
+            await TgReport().send_log(logs=reports)
+
+            if group.status is True:
+                to_sleep = randint(*SLEEP_AFTER_ACCOUNT)
+                logger.opt(colors=True).debug(f'[•] <white>Group {group.group_number}</white> | Sleep {to_sleep}s')
+                await async_sleep(to_sleep)
+            else:
+                await async_sleep(10)
 
 
 async def runner(mode: int):
-    sem = asyncio.Semaphore(THREADS)
+    db.start_checkpointer()
 
-    sleep_history = []
-    if mode == 4:
-        all_groups = db.get_all_groups()
-        if all_groups != 'No more accounts left':
-            await asyncio.gather(*[
-                run_pair(group_data=group_data, mode=mode, sem=sem, sleep_history=sleep_history)
-                for group_data in all_groups
-            ])
+    try:
+        sleep_history = []
+        if mode == 4:
+            worker = lambda group: run_pair(group=group, mode=mode, sleep_history=sleep_history)
+        else:
+            worker = lambda module_task: run_modules(mode=mode, module_task=module_task, sleep_history=sleep_history)
+
+        if DATABASE_LEASES["enabled"]:
+            scheduler = db.get_lease_queue(unique_wallets=mode in [2, 3, 5], is_groups=mode == 4)
+        else:
+            if mode == 4:
+                all_tasks = db.get_all_groups()
+            else:
+                all_tasks = db.get_all_modules(unique_wallets=mode in [2, 3, 5])
+            scheduler = None if all_tasks == 'No more accounts left' else TaskScheduler(all_tasks)
+
+        if scheduler is not None:
+            await scheduler.run(worker=worker, workers_amount=THREADS)
 
-    else:
-        all_modules = db.get_all_modules(unique_wallets=mode in [2, 3, 5])
-        if all_modules != 'No more accounts left':
-            await asyncio.gather(*[
-                run_modules(
-                    mode=mode,
-                    module_data=module_data,
-                    sem=sem,
-                    sleep_history=sleep_history,
-                )
-                for module_data in all_modules
-            ])
+    finally:
+        await db.stop_checkpointer()
+        await market_scanner.stop()
+        await close_connectors()
+        logger.debug(f'Order book cache: {book_cache.stats()}')
+        logger.debug(f'Topic cache: {topic_cache.stats()}')
 
     logger.success(f'All accounts done.')
     return 'Ended'
 
 
+def run_shard(mode: int, shard: tuple[int, int], personal_key: Fernet, counters):
+    global db, SLEEP_LOCK
+    if os.name == "nt":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    db = DataBase(shard=shard, counters=counters)
+    db.personal_key = personal_key
+    SLEEP_LOCK = asyncio.Lock()
+    try:
+        asyncio.run(runner(mode=mode))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+
+
+def run_processes(mode: int):
+    db.get_password()
+    db.reset_failed_modules()
+    db.state.drop_cache()
+
+    # forked children would inherit the open sqlite connection, wal file and executor of this process
+    context = multiprocessing.get_context("spawn")
+    counters = context.Array('q', 2)
+    processes = [
+        context.Process(target=run_shard, args=(mode, (index, PROCESSES), db.personal_key, counters))
+        for index in range(PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f'[•] Soft | Started {PROCESSES} processes with {THREADS} threads each')
+
+    try:
+        while True:
+            running = any(process.is_alive() for process in processes)
+            db.window_name.accs_done, db.window_name.modules_done = counters[:]
+            db.window_name.update_name()
+            if not running: break
+            sleep(1)
+    finally:
+        for process in processes:
+            process.join()
+        db.state.drop_cache()
+
+    failed = [index for index, process in enumerate(processes) if process.exitcode != 0]
+    if failed:
+        raise SoftError(f'Processes {failed} stopped with error')
+    return 'Ended'
+
+
 if __name__ == '__main__':
     if os.name == "nt":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+    db = None
     try:
         db = DataBase()
         SLEEP_LOCK = asyncio.Lock()
@@ -174,10 +243,19 @@ if __name__ == '__main__':
 
             match mode.type:
                 case "database":
-                    db.create_modules(mode=mode.soft_id)
+                    if mode.soft_id == 103:
+                        db.export_json()
+                    elif mode.soft_id in [104, 105]:
+                        db.sync_modules(readd_completed=mode.soft_id == 105)
+                    else:
+                        db.create_modules(mode=mode.soft_id)
 
                 case "module":
-                    if asyncio.run(runner(mode=mode.soft_id)) == "Ended": break
+                    if PROCESSES > 1 and DATABASE_ENGINE != "sqlite":
+                        logger.warning(f'[-] Soft | PROCESSES > 1 works only with DATABASE_ENGINE = "sqlite", running in one process')
+                    if PROCESSES > 1 and DATABASE_ENGINE == "sqlite" and mode.soft_id != 4:
+                        if run_processes(mode=mode.soft_id) == "Ended": break
+                    elif asyncio.run(runner(mode=mode.soft_id)) == "Ended": break
                     print('')
 
 
@@ -194,6 +272,8 @@ if __name__ == '__main__':
         pass
 
     finally:
+        if db:
+            db.close()
         logger.info('[•] Soft | Closed')
 
 
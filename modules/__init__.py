@@ -1,7 +1,7 @@
 # tools
 from .utils import utils, choose_mode, TgReport
-from .config import address_locks, MultiLock
 from .database import DataBase
+from .tasks import Account, ModuleTask, GroupTask, TaskScheduler
 from .wallet import Wallet
 
 # modules
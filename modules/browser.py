@@ -1,13 +1,76 @@
 from urllib.parse import urlparse, parse_qs
-from random import choices, choice, shuffle
+from random import choices, choice
+from typing import TypedDict, Any
 from aiohttp import ClientSession
 from string import hexdigits
 from loguru import logger
 from time import time
 
 from modules import DataBase
-from modules.retry import retry, have_json
-from settings import BID_SETTINGS
+from modules.retry import retry
+from modules.utils import get_connector, codec, AsyncTTLCache
+from modules.scanner import MarketScanner
+from settings import BID_SETTINGS, BOOK_CACHE, TOPIC_CACHE, MARKET_SCANNER
+
+
+# only the fields the soft reads, msgspec skips the rest while decoding
+class Depth(TypedDict):
+    asks: list[list[Any]]
+    bids: list[list[Any]]
+
+
+class DepthResponse(TypedDict, total=False):
+    errno: Any
+    errmsg: Any
+    result: Depth | None
+
+
+class Order(TypedDict, total=False):
+    transNo: str
+    side: Any
+    outcomeSide: Any
+    price: Any
+    filled: Any
+    totalPrice: Any
+    topicTitle: Any
+    mutilTitle: Any
+
+
+class OrderList(TypedDict, total=False):
+    list: list[Order] | None
+
+
+class OrdersResponse(TypedDict, total=False):
+    errno: Any
+    errmsg: Any
+    result: OrderList | None
+
+
+class Position(TypedDict, total=False):
+    topicId: Any
+    mutilTopicId: Any
+    topicTitle: Any
+    mutilTitle: Any
+    tokenId: Any
+    tokenAmount: Any
+    value: Any
+    outcome: Any
+    outcomeSide: Any
+
+
+class PositionList(TypedDict, total=False):
+    list: list[Position] | None
+
+
+class PortfolioResponse(TypedDict, total=False):
+    errno: Any
+    errmsg: Any
+    result: PositionList | None
+
+
+book_cache = AsyncTTLCache(ttl=BOOK_CACHE["seconds"], max_size=BOOK_CACHE["size"])
+topic_cache = AsyncTTLCache(ttl=TOPIC_CACHE["seconds"], max_size=TOPIC_CACHE["size"])
+market_scanner = MarketScanner()
 
 
 class Browser:
@@ -16,6 +79,7 @@ class Browser:
         self.max_retries = 5
         self.address = address
         self.db = db
+        self.relogin = None
 
         if proxy not in ['https://log:pass@ip:port', 'http://log:pass@ip:port', 'log:pass@ip:port', '', None]:
             self.proxy = "http://" + proxy.removeprefix("https://").removeprefix("http://")
@@ -35,7 +99,13 @@ class Browser:
             "x-device-fingerprint": "".join(choices(hexdigits, k=32)).lower(),
         }
 
-        session = ClientSession(headers=headers)
+        # connections are shared between accounts, cookies and headers stay per session
+        session = ClientSession(
+            headers=headers,
+            connector=get_connector(self.proxy),
+            connector_owner=False,
+            json_serialize=codec.dumps,
+        )
         session.proxy = self.proxy
 
         self.sessions.append(session)
@@ -47,8 +117,7 @@ class Browser:
             await session.close()
 
 
-    @have_json
-    async def send_request(self, **kwargs):
+    async def send_request(self, error_text: str = None, response_type: type = None, **kwargs):
         if kwargs.get("session"):
             session = kwargs["session"]
             del kwargs["session"]
@@ -59,15 +128,35 @@ class Browser:
         if self.proxy:
             kwargs["proxy"] = self.proxy
 
-        return await session.request(**kwargs)
+        response = await session.request(**kwargs)
+        if response.status == 401 and self.relogin and session is self.session:
+            # cached session token expired earlier than expected
+            response.release()
+            relogin, self.relogin = self.relogin, None
+            try:
+                self.session.headers.pop("Authorization", None)
+                await relogin()
+            finally:
+                self.relogin = relogin
+            response = await session.request(**kwargs)
+
+        body = await response.read()
+        try:
+            response_json = codec.loads(body, type=response_type)
+        except ValueError:
+            error_msg = body[:350].decode(errors="replace").replace("\n", " ")
+            raise Exception(f'bad json response: {error_msg}')
+
+        if error_text and (response_json.get("errmsg") or response_json.get("errno")):
+            raise Exception(f'{error_text}: {response_json}')
+        return response_json
 
 
     async def is_user_registered(self, retry: int = 0):
-        r = await self.send_request(
+        response = await self.send_request(
             method="GET",
             url=f'https://proxy.opinion.trade:8443/api/bsc/api/v1/user/is/new/user?wallet_address={self.address}',
         )
-        response = await r.json()
         if not response.get("result") or "result" not in response["result"]:
             if retry < 5:
                 return await self.is_user_registered(retry + 1)
@@ -76,7 +165,7 @@ class Browser:
 
 
     async def user_login(self, sign_text: str, signature: str, timestamp: int, nonce: int | str):
-        r = await self.send_request(
+        response = await self.send_request(
             method="POST",
             url='https://proxy.opinion.trade:8443/api/bsc/api/v1/user/token',
             json={
@@ -88,50 +177,51 @@ class Browser:
                 "sources": "web",
                 "sign_in_wallet_plugin": None
             },
+            error_text="Failed to user login",
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno"):
-            raise Exception(f'Failed to user login: {response}')
 
+        self.set_token(response["result"]["token"])
+        return response["result"]["token"]
+
+
+    def set_token(self, token: str):
         self.session.headers.update({
-            "Authorization": "Bearer " + response["result"]["token"],
+            "Authorization": "Bearer " + token,
             "x-aws-waf-token": "",
         })
 
 
     async def get_profile_info(self):
-        r = await self.send_request(
+        response = await self.send_request(
             method="GET",
             url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/user/{self.address}/profile?chainId=56',
+            error_text="Failed to get profile info",
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno"):
-            raise Exception(f'Failed to get profile info: {response}')
         return response["result"]
 
 
     async def is_approved(self, proxy_address: str):
-        r = await self.send_request(
+        response = await self.send_request(
             method="GET",
             url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/gnosis_safe/{proxy_address}/approved?chainId=56',
+            error_text="Failed to get is approved",
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno"):
-            raise Exception(f'Failed to get is approved: {response}')
         return response["result"]
 
 
-    async def get_events(self, event_to_find: dict = None):
-        def _parse_event(event: dict, event_name: str = ""):
-            return {
-                "name": event_name + (" " if event_name else "") + event["title"],
-                "prices": [float(event.get("yesBuyPrice") or event["yesMarketPrice"]), float(event.get("noBuyPrice") or event["noMarketPrice"])],
-                "tokens": [event["yesPos"], event["noPos"]],
-                "labels": [event["yesLabel"], event["noLabel"]],
-                "is_child": bool(event_name),
-                "raw_event": event,
-            }
+    @staticmethod
+    def parse_event(event: dict, event_name: str = ""):
+        return {
+            "name": event_name + (" " if event_name else "") + event["title"],
+            "prices": [float(event.get("yesBuyPrice") or event["yesMarketPrice"]), float(event.get("noBuyPrice") or event["noMarketPrice"])],
+            "tokens": [event["yesPos"], event["noPos"]],
+            "labels": [event["yesLabel"], event["noLabel"]],
+            "is_child": bool(event_name),
+            "raw_event": event,
+        }
+
 
+    async def get_events(self, event_to_find: dict = None):
         if BID_SETTINGS["LIST"] or BID_SETTINGS["SINGLE_BUY"] or event_to_find:
             if event_to_find:
                 event_url = event_to_find["link"]
@@ -147,32 +237,23 @@ class Browser:
                 parse_qs(urlparse(event_url).query).items()
             }
 
-            api_url = "https://proxy.opinion.trade:8443/api/bsc/api/v2/topic/"
-            if event_params.get("type") == "multi":
-                api_url += "mutil/"
-            r = await self.send_request(
-                method="GET",
-                url=api_url + event_params["topicId"],
+            # topic details barely change, prices come from the fresh book below
+            is_multi = event_params.get("type") == "multi"
+            topic_events = await topic_cache.get(
+                key=(event_params["topicId"], is_multi),
+                loader=lambda: self.get_topic_events(topic_id=event_params["topicId"], is_multi=is_multi),
             )
-            response = await r.json()
-            event = response["result"]["data"]
-            if event["childList"]:
-                raw_events = []
-                for child in event["childList"]:
-                    parsed_child = _parse_event(child, event_name=event["title"])
-                    if (
-                        not event_to_find or
-                        parsed_child["raw_event"]["title"] == event_to_find["event_name"]
-                    ):
-                        if event_to_find:
-                            parsed_child["force_vote"] = event_to_find["vote"]
-
-                        raw_events.append(parsed_child)
-            else:
-                parsed_event = _parse_event(event)
-                if event_to_find:
-                    parsed_event["force_vote"] = event_to_find["vote"]
-                raw_events = [parsed_event]
+            raw_events = []
+            for topic_event in topic_events:
+                if (
+                    not event_to_find or
+                    not topic_event["is_child"] or
+                    topic_event["raw_event"]["title"] == event_to_find["event_name"]
+                ):
+                    parsed_event = {**topic_event, "prices": topic_event["prices"].copy()}
+                    if event_to_find:
+                        parsed_event["force_vote"] = event_to_find["vote"]
+                    raw_events.append(parsed_event)
 
             if raw_events:
                 parsed_events = [choice(raw_events)]
@@ -180,38 +261,16 @@ class Browser:
                 parsed_events = []
 
         else:
-            r = await self.send_request(
-                method="GET",
-                url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/topic',
-                params={
-                    "labelId": "",
-                    "keywords": "",
-                    "sortBy": 3,
-                    "chainId": 56,
-                    "limit": 30,
-                    "status": 2,
-                    "isShow": 1,
-                    "topicType": 2,
-                    "page": 1,
-                    "indicatorType": "2",
-                },
+            # events are picked from the ranked index, the book of the chosen one is checked again below
+            market_scanner.start(
+                new_browser=lambda: Browser(proxy=choice(self.db.proxies) if self.db.proxies else self.proxy, address=None, db=self.db)
             )
-            response = await r.json()
-            if response.get("errmsg") or response.get("errno"):
-                raise Exception(f'Failed to parse events: {response}')
-
-            raw_events = []
-            for event in response["result"]["list"]:
-                if event["childList"]:
-                    for child in event["childList"]:
-                        raw_events.append(_parse_event(child, event_name=event["title"]))
-                else:
-                    raw_events.append(_parse_event(event))
-
             parsed_events = []
-            shuffle(raw_events)
-            for event in raw_events:
-                if min(event["prices"]) * 100 < BID_SETTINGS["PARSE"]["min_event_percent"]: continue
+            while not parsed_events:
+                event = await market_scanner.get_event()
+                if not event:
+                    break
+
                 book = await self.get_event_book(
                     question_id=event["raw_event"]["questionId"],
                     symbol=event["raw_event"]["yesPos"],
@@ -221,8 +280,8 @@ class Browser:
                 if spread <= BID_SETTINGS["PARSE"]["max_spread"]:
                     event["prices"] = [book["asks"][0], round(1 - book["bids"][0], 3)]
                     parsed_events.append(event)
-                    if len(parsed_events) > 2: # to optimize requests
-                        break
+                else:
+                    market_scanner.drop(event)
 
         if parsed_events:
             choose_event = choice(parsed_events)
@@ -237,9 +296,67 @@ class Browser:
             return choose_event
 
 
+    async def get_topic_events(self, topic_id: str, is_multi: bool):
+        api_url = "https://proxy.opinion.trade:8443/api/bsc/api/v2/topic/"
+        if is_multi:
+            api_url += "mutil/"
+        response = await self.send_request(
+            method="GET",
+            url=api_url + topic_id,
+        )
+        event = response["result"]["data"]
+        if event["childList"]:
+            return [
+                self.parse_event(child, event_name=event["title"])
+                for child in event["childList"]
+            ]
+        return [self.parse_event(event)]
+
+
+    async def get_topics(self):
+        response = await self.send_request(
+            method="GET",
+            url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/topic',
+            params={
+                "labelId": "",
+                "keywords": "",
+                "sortBy": 3,
+                "chainId": 56,
+                "limit": MARKET_SCANNER["topics"],
+                "status": 2,
+                "isShow": 1,
+                "topicType": 2,
+                "page": 1,
+                "indicatorType": "2",
+            },
+            error_text="Failed to parse events",
+        )
+
+        events = []
+        for event in response["result"]["list"]:
+            if event["childList"]:
+                for child in event["childList"]:
+                    events.append(self.parse_event(child, event_name=event["title"]))
+            else:
+                events.append(self.parse_event(event))
+        return events
+
+
     @retry(source="Browser")
     async def get_event_book(self, question_id: str, symbol: str, event_choice_index: int):
-        r = await self.send_request(
+        # accounts trading the same market share one request
+        book = await book_cache.get(
+            key=(question_id, symbol, str(event_choice_index)),
+            loader=lambda: self.load_event_book(question_id, symbol, event_choice_index),
+        )
+        return {
+            "asks": book["asks"].copy(),
+            "bids": book["bids"].copy(),
+        }
+
+
+    async def load_event_book(self, question_id: str, symbol: str, event_choice_index: int):
+        response = await self.send_request(
             method="GET",
             url='https://proxy.opinion.trade:8443/api/bsc/api/v2/order/market/depth',
             params={
@@ -248,10 +365,9 @@ class Browser:
                 "symbol": symbol,
                 "chainId": "56",
             },
+            error_text="Failed to get event book",
+            response_type=DepthResponse,
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno"):
-            raise Exception(f'Failed to get event book: {response}')
 
         book = response["result"]
         asks = sorted(book["asks"], key=lambda x: float(x[0]))
@@ -287,14 +403,12 @@ class Browser:
             "price": price,
             "tradingMethod": 1 if price == "0" else 2,
         })
-        r = await self.send_request(
+        response = await self.send_request(
             method="POST",
             url='https://proxy.opinion.trade:8443/api/bsc/api/v2/order',
             json=payload,
+            error_text="Failed to create order",
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno"):
-            raise Exception(f'Failed to create order: {response}')
 
         return response["result"]["orderData"]
 
@@ -318,13 +432,14 @@ class Browser:
         if topic_id:
             params["parentTopicId" if is_parent else "topicId"] = topic_id
 
-        r = await self.send_request(
+        response = await self.send_request(
             method="GET",
             url='https://proxy.opinion.trade:8443/api/bsc/api/v2/order',
             params=params,
+            error_text="Failed to get orders",
+            response_type=OrdersResponse,
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno") or response.get("result") is None:
+        if response.get("result") is None:
             raise Exception(f'Failed to get orders: {response}')
 
         orders = response["result"]["list"]
@@ -347,14 +462,13 @@ class Browser:
             params["topicId"] = topic_id
         else:
             params["chainId"] = "56"
-        r = await self.send_request(
+        response = await self.send_request(
             method="GET",
             url='https://proxy.opinion.trade:8443/api/bsc/api/v2/portfolio',
             params=params,
+            error_text="Failed to get position",
+            response_type=PortfolioResponse,
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno"):
-            raise Exception(f'Failed to get position: {response}')
 
         positions = response["result"]["list"]
         if outcome_side:
@@ -367,7 +481,7 @@ class Browser:
 
 
     async def get_rank(self):
-        r = await self.send_request(
+        response = await self.send_request(
             method="GET",
             url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/leaderboard/{self.address}',
             params={
@@ -375,33 +489,29 @@ class Browser:
                 "chainId": "56",
                 "period": "0",
             },
+            error_text="Failed to get rank",
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno"):
-            raise Exception(f'Failed to get rank: {response}')
         return response["result"]["id"] if response["result"] else 0
 
 
     async def get_points(self):
-        r = await self.send_request(
+        response = await self.send_request(
             method="GET",
             url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/points?sources=web',
+            error_text="Failed to get points",
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno"):
-            raise Exception(f'Failed to get points: {response}')
         return round(response["result"]["totalPoints"], 2) if response["result"] else 0
 
 
     async def cancel_order(self, trans_no: str):
-        r = await self.send_request(
+        response = await self.send_request(
             method="POST",
             url=f'https://proxy.opinion.trade:8443/api/bsc/api/v1/order/cancel/order',
             json={
                 "trans_no": trans_no,
                 "chainId": 56,
             },
+            error_text="Failed to cancel order",
         )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno") or not response["result"]["result"]:
+        if not response["result"]["result"]:
             raise Exception(f'Failed to cancel order: {response}')
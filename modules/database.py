@@ -1,42 +1,105 @@
-from random import choice, randint, shuffle
+from random import choice, randint, shuffle, sample
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict, Counter
 from cryptography.fernet import Fernet
-from base64 import urlsafe_b64encode
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 from time import sleep, time
-from os import path, mkdir
+from os import path, mkdir, remove, cpu_count, getpid
+from socket import gethostname
 from loguru import logger
+from typing import Iterable
 from hashlib import md5
+from zlib import crc32
+from glob import glob
+from tqdm import tqdm
 import asyncio
-import json
 
 from .retry import DataBaseError
-from modules.utils import get_address, WindowName, sleeping
-from settings import SHUFFLE_WALLETS, BID_AMOUNTS, PAIR_SETTINGS
+from .storage import JsonStorage, SqliteStorage, ReportJournal
+from .state import StateStore
+from .tasks import Account, ModuleTask, GroupTask, ModulesQueue, LeaseQueue
+from modules.utils import get_address, WindowName, SharedWindowName, sleeping, codec
+from settings import (
+    SHUFFLE_WALLETS,
+    BID_AMOUNTS,
+    PAIR_SETTINGS,
+    DATABASE_ENGINE,
+    DATABASE_CHECKPOINT,
+    DATABASE_LEASES,
+    SESSION_TOKEN_HOURS,
+    ACCOUNT_INFO_HOURS,
+    THREADS,
+)
 
 from cryptography.fernet import InvalidToken
 
 
+worker_personal_key: Fernet | None = None
+
+
+def init_encrypt_worker(personal_key: Fernet):
+    global worker_personal_key
+    worker_personal_key = personal_key
+
+
+def prepare_account(raw_pkey: str):
+    pkey_data = raw_pkey.split(':')
+    if len(pkey_data) == 2:
+        label, privatekey = pkey_data
+        address = get_address(privatekey)
+
+    elif len(pkey_data) == 1:
+        privatekey = pkey_data[0]
+        address = get_address(privatekey)
+        label = address[:6] + '...' + address[-4:]
+
+    else:
+        raise DataBaseError(f"Unexpected Privatekey key format: {raw_pkey}")
+
+    return label, worker_personal_key.encrypt(privatekey.encode()).decode(), address
+
+
 class DataBase:
-    def __init__(self):
+    def __init__(self, shard: tuple[int, int] | None = None, counters=None):
 
         self.modules_db_name = 'databases/modules.json'
-        self.report_db_name = 'databases/report.json'
+        self.sqlite_db_name = 'databases/modules.sqlite3'
+        self.wal_name = f'databases/modules.{DATABASE_ENGINE}.wal'
+        self.report_db_name = 'databases/report.jsonl'
         self.stats_db_name = 'databases/stats.json'
+        self.cache_db_name = 'databases/account_cache.json'
         self.personal_key = None
         self.window_name = None
+        self.shard = shard
+        self.counters = counters
+        self.decoded_pks = OrderedDict()
+        self.decoded_pks_limit = THREADS * max(PAIR_SETTINGS["pair_amount"]) * 2
 
         self.changes_lock = asyncio.Lock()
+        self.io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database-io")
 
         # create db's if not exists
         if not path.isdir(self.modules_db_name.split('/')[0]):
             mkdir(self.modules_db_name.split('/')[0])
 
-        for db_params in [
-            {"name": self.modules_db_name, "value": "[]"},
-            {"name": self.report_db_name, "value": "{}"},
-            {"name": self.stats_db_name, "value": "{}"},
-        ]:
-            if not path.isfile(db_params["name"]):
-                with open(db_params["name"], 'w') as f: f.write(db_params["value"])
+        if self.shard:
+            if DATABASE_ENGINE != "sqlite":
+                raise DataBaseError(f'PROCESSES > 1 works only with DATABASE_ENGINE = "sqlite"')
+            self.wal_name = f'databases/modules.{DATABASE_ENGINE}.{self.shard[0]}.wal'
+            self.report_db_name = f'databases/report_{self.shard[0]}.jsonl'
+
+        self.storage = self.get_storage()
+        if not self.shard:
+            self.recover_shards()
+        self.state = StateStore(
+            storage=self.storage,
+            wal_name=self.wal_name,
+            checkpoint_seconds=DATABASE_CHECKPOINT["seconds"],
+            checkpoint_changes=DATABASE_CHECKPOINT["changes"],
+            lock=self.changes_lock,
+            executor=self.io_executor,
+        )
+        self.reports = ReportJournal(self.report_db_name)
 
         with open('input_data/proxies.txt') as f:
             self.proxies = [
@@ -46,12 +109,75 @@ class DataBase:
             ]
 
         amounts = self.get_amounts()
+        if self.shard: return
         if amounts.get("groups_amount"):
             logger.info(f'Loaded {amounts["groups_amount"]} groups\n')
         else:
             logger.info(f'Loaded {amounts["modules_amount"]} modules for {amounts["accs_amount"]} accounts\n')
 
 
+    def get_storage(self):
+        if DATABASE_ENGINE == "json":
+            return JsonStorage(self.modules_db_name, self.stats_db_name, self.cache_db_name)
+
+        elif DATABASE_ENGINE == "sqlite":
+            storage = SqliteStorage(self.sqlite_db_name, shared=DATABASE_LEASES["enabled"])
+            if storage.is_new and path.isfile(self.modules_db_name):
+                json_storage = JsonStorage(self.modules_db_name, self.stats_db_name, self.cache_db_name)
+                modules_db = json_storage.load()
+                if modules_db:
+                    storage.replace_all(modules_db)
+                    storage.replace_stats(json_storage.load_stats())
+                    logger.success(f'[+] Database | Imported {len(modules_db)} entries from {self.modules_db_name}')
+            return storage
+
+        else:
+            raise DataBaseError(f'Unsupported DATABASE_ENGINE "{DATABASE_ENGINE}"')
+
+
+    def recover_shards(self):
+        for wal_name in glob(f'databases/modules.{DATABASE_ENGINE}.*.wal'):
+            StateStore(
+                storage=self.storage,
+                wal_name=wal_name,
+                checkpoint_seconds=DATABASE_CHECKPOINT["seconds"],
+                checkpoint_changes=DATABASE_CHECKPOINT["changes"],
+                lock=self.changes_lock,
+                executor=self.io_executor,
+            ).close()
+            remove(wal_name)
+
+
+    def in_shard(self, key: str):
+        return self.shard is None or crc32(key.encode()) % self.shard[1] == self.shard[0]
+
+
+    def start_checkpointer(self):
+        self.state.start_checkpointer()
+
+
+    async def stop_checkpointer(self):
+        await self.state.stop_checkpointer()
+
+
+    def close(self):
+        self.state.close()
+        self.io_executor.shutdown()
+
+
+    async def run_io(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, func, *args)
+
+
+    def export_json(self):
+        modules_db = self.state.load()
+        stats = self.state.load_stats()
+        with open(self.modules_db_name, 'wb') as f: f.write(codec.encode(modules_db))
+        # progress counters are imported back from stats.json together with modules.json
+        with open(self.stats_db_name, 'wb') as f: f.write(codec.encode({"modules_done": stats}))
+        logger.info(f'Exported {len(modules_db)} entries to {self.modules_db_name} and {len(stats)} progress counters to {self.stats_db_name}\n')
+
+
     def set_password(self):
         if self.personal_key is not None: return
 
@@ -72,12 +198,12 @@ class DataBase:
     def get_password(self):
         if self.personal_key is not None: return
 
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        if modules_db:
-            if list(modules_db.values())[0].get("group_number"):
-                test_key = list(modules_db.values())[0]["wallets_data"][0]["encoded_privatekey"]
+        first_entry = self.state.first()
+        if first_entry:
+            if first_entry[1].get("group_number"):
+                test_key = first_entry[1]["wallets_data"][0]["encoded_privatekey"]
             else:
-                test_key = list(modules_db.keys())[0]
+                test_key = first_entry[0]
         else: return
 
         if not test_key: return
@@ -116,51 +242,123 @@ class DataBase:
         return key.decrypt(pk).decode()
 
 
+    def get_privatekey(self, encoded_pk: str, address: str):
+        if address in self.decoded_pks:
+            self.decoded_pks.move_to_end(address)
+            return self.decoded_pks[address]
+
+        privatekey = self.decode_pk(pk=encoded_pk)
+        self.decoded_pks[address] = privatekey
+        if len(self.decoded_pks) > self.decoded_pks_limit:
+            self.decoded_pks.popitem(last=False)
+        return privatekey
+
+
+    async def get_account_cache(self, address: str):
+        return await self.run_io(self.storage.get_account_cache, address)
+
+
+    async def update_account_cache(self, address: str, **changes):
+        await self.run_io(self.storage.update_account_cache, address, changes)
+
+
+    def get_session_token(self, account_cache: dict):
+        if not SESSION_TOKEN_HOURS: return None
+
+        if account_cache.get("token") and account_cache["token_expires"] > time() + 60:
+            try:
+                return self.decode_pk(pk=account_cache["token"])
+            except InvalidToken: # saved with another password
+                return None
+
+
+    async def save_session_token(self, address: str, token: str):
+        if not SESSION_TOKEN_HOURS: return
+
+        expires = time() + SESSION_TOKEN_HOURS * 3600
+        try:
+            payload = codec.loads(urlsafe_b64decode(token.split('.')[1] + '=='))
+            expires = min(expires, payload["exp"])
+        except Exception: # not a jwt, keep only settings lifetime
+            pass
+
+        await self.update_account_cache(address, token=self.encode_pk(pk=token), token_expires=expires)
+
+
+    def get_account_info(self, account_cache: dict):
+        if (
+                account_cache.get("registered") and
+                account_cache.get("proxy_wallet") and
+                account_cache.get("approved") and
+                account_cache["info_checked"] + ACCOUNT_INFO_HOURS * 3600 > time()
+        ):
+            return account_cache
+
+
+    async def save_account_info(self, address: str, proxy_wallet: str):
+        if not ACCOUNT_INFO_HOURS: return
+        await self.update_account_cache(
+            address,
+            registered=True,
+            proxy_wallet=proxy_wallet,
+            approved=True,
+            info_checked=time(),
+        )
+
+
+    async def drop_account_info(self, address: str):
+        await self.update_account_cache(address, registered=None, proxy_wallet=None, approved=None, info_checked=None)
+
+
     def create_modules(self, mode: int):
 
-        def create_single_trades(privatekeys, proxies, labels):
+        def create_single_trades(accounts, proxies):
             return {
-                self.encode_pk(pk): {
-                    "address": get_address(pk),
+                encoded_pk: {
+                    "address": address,
                     "modules": [{"module_name": "opinion", "status": "to_run"} for _ in range(randint(*BID_AMOUNTS))],
                     "proxy": proxy,
                     "label": label,
                 }
-                for pk, proxy, label in zip(privatekeys, proxies, labels)
+                for (label, encoded_pk, address), proxy in zip(accounts, proxies)
             }
 
-        def create_pair_trades(privatekeys, proxies, labels):
+        def create_pair_trades(accounts, proxies):
             min_pair_size = max(2, min(*PAIR_SETTINGS["pair_amount"]))
-            if len(privatekeys) < min_pair_size:
+            if len(accounts) < min_pair_size:
                 raise DataBaseError(f'Not enough accounts loaded, need at least {min_pair_size}')
 
-            encoded_privatekeys = [self.encode_pk(pk) for pk in privatekeys]
-            addresses = [get_address(pk) for pk in privatekeys]
-            all_modules = [
-                {
-                    'encoded_privatekey': encoded_pk,
-                    'address': address,
-                    'proxy': proxy,
-                    "label": label,
-                }
-                for encoded_pk, address, proxy, label in zip(encoded_privatekeys, addresses, proxies, labels)
-                for _ in range(randint(*BID_AMOUNTS))
+            wallets_left = [
+                [
+                    {
+                        'encoded_privatekey': encoded_pk,
+                        'address': address,
+                        'proxy': proxy,
+                        "label": label,
+                    },
+                    randint(*BID_AMOUNTS)
+                ]
+                for (label, encoded_pk, address), proxy in zip(accounts, proxies)
             ]
 
             pairs_list = []
             while True:
                 pair_size = max(2, randint(*PAIR_SETTINGS["pair_amount"]))
-                unique_wallets_left = list({module["address"]: module for module in all_modules}.values())
-                if len(unique_wallets_left) < min_pair_size:
+                if len(wallets_left) < min_pair_size:
                     break
-                if len(unique_wallets_left) < pair_size:
+                if len(wallets_left) < pair_size:
                     pair_size = min_pair_size
 
                 pairs_list.append([])
-                for _ in range(pair_size):
-                    random_wallet_module = unique_wallets_left.pop(randint(0, len(unique_wallets_left) - 1))
-                    all_modules.remove(random_wallet_module)
-                    pairs_list[-1].append(random_wallet_module)
+                # descending order keeps swap-removal from touching indexes not picked yet
+                for wallet_index in sorted(sample(range(len(wallets_left)), pair_size), reverse=True):
+                    wallet_left = wallets_left[wallet_index]
+                    pairs_list[-1].append({**wallet_left[0]})
+                    wallet_left[1] -= 1
+                    if wallet_left[1] == 0:
+                        wallets_left[wallet_index] = wallets_left[-1]
+                        wallets_left.pop()
+                shuffle(pairs_list[-1])
 
             pairs_list = {
                 f"{pair_index + 1}_{int(time())}": {
@@ -176,41 +374,23 @@ class DataBase:
         self.set_password()
 
         with open('input_data/privatekeys.txt') as f:
-            raw_privatekeys = f.read().splitlines()
-        with open('input_data/proxies.txt') as f:
-            proxies = f.read().splitlines()
-
-        labels = []
-        privatekeys = []
-        for raw_pkey in raw_privatekeys:
-            pkey_data = raw_pkey.split(':')
-            if len(pkey_data) == 2:
-                labels.append(pkey_data[0])
-                privatekeys.append(pkey_data[1])
-
-            elif len(pkey_data) == 1:
-                address = get_address(pkey_data[0])
-                labels.append(address[:6] + '...' + address[-4:])
-                privatekeys.append(pkey_data[0])
-
-            else:
-                raise DataBaseError(f"Unexpected Privatekey key format: {raw_pkey}")
-
-        if len(proxies) == 0 or proxies == [""] or proxies == ["http://login:password@ip:port"]:
-            logger.error('You will not use proxy')
-            proxies = [None for _ in range(len(privatekeys))]
-        else:
-            proxies = list(proxies * (len(privatekeys) // len(proxies) + 1))[:len(privatekeys)]
+            keys_amount = sum(1 for raw_pkey in f if raw_pkey.strip())
+        with open('input_data/privatekeys.txt') as f:
+            accounts = self.prepare_accounts(
+                raw_pkeys=(raw_pkey.strip() for raw_pkey in f if raw_pkey.strip()),
+                keys_amount=keys_amount,
+            )
+        proxies = self.get_input_proxies(len(accounts))
 
-        with open(self.report_db_name, 'w') as f: f.write('{}')  # clear report db
+        self.reports.clear()
 
         if mode == 102:
             create_func = create_pair_trades
         else:
             create_func = create_single_trades
-        new_modules = create_func(privatekeys, proxies, labels)
+        new_modules = create_func(accounts, proxies)
 
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(new_modules, f)
+        self.state.replace_all(new_modules)
         amounts = self.get_amounts()
         if mode == 102:
             logger.info(f'Created Database with {amounts["groups_amount"]} groups!\n')
@@ -219,63 +399,189 @@ class DataBase:
             logger.info(f'Created Database for {amounts["accs_amount"]} accounts with {amounts["modules_amount"]} modules!\n')
 
 
+    def sync_modules(self, readd_completed: bool = False):
+        self.get_password()
+        self.set_password()
+
+        modules_db = self.state.load()
+        if any(entry.get("group_number") is not None for entry in modules_db.values()):
+            raise DataBaseError(f'Sync is supported only for single database, create new groups database instead')
+
+        with open('input_data/privatekeys.txt') as f:
+            raw_pkeys = [raw_pkey.strip() for raw_pkey in f if raw_pkey.strip()]
+        proxies = self.get_input_proxies(len(raw_pkeys))
+        with open('input_data/proxies.txt') as f:
+            input_proxies = set(f.read().splitlines())
+
+        existing_keys = {
+            self.decode_pk(pk=encoded_pk).lower().removeprefix("0x"): encoded_pk
+            for encoded_pk in modules_db
+        }
+
+        changes = {}
+        new_raw_pkeys = []
+        proxies_usage = Counter()
+        for raw_pkey, proxy in zip(raw_pkeys, proxies):
+            pkey_data = raw_pkey.split(':')
+            encoded_pk = existing_keys.pop(pkey_data[-1].lower().removeprefix("0x"), None)
+            if encoded_pk is None:
+                new_raw_pkeys.append(raw_pkey)
+                continue
+
+            account_data = modules_db[encoded_pk]
+            label = pkey_data[0] if len(pkey_data) == 2 else account_data["label"]
+            # account keeps its proxy while it is still in proxies.txt, removed keys must not shift others
+            if account_data["proxy"] in input_proxies:
+                proxy = account_data["proxy"]
+            proxies_usage[proxy] += 1
+            if account_data["proxy"] != proxy or account_data["label"] != label:
+                changes[encoded_pk] = {**account_data, "proxy": proxy, "label": label}
+
+        new_proxies = []
+        unique_proxies = list(dict.fromkeys(proxies))
+        for _ in new_raw_pkeys:
+            # new accounts take the least used proxies
+            proxy = min(unique_proxies, key=lambda proxy: proxies_usage[proxy])
+            proxies_usage[proxy] += 1
+            new_proxies.append(proxy)
+
+        retired_addresses = []
+        for encoded_pk in existing_keys.values():
+            retired_addresses.append(modules_db[encoded_pk]["address"])
+            changes[encoded_pk] = None
+
+        new_modules = {}
+        completed_amount = 0
+        if new_raw_pkeys:
+            new_accounts = self.prepare_accounts(raw_pkeys=new_raw_pkeys, keys_amount=len(new_raw_pkeys))
+            for (label, encoded_pk, address), proxy in zip(new_accounts, new_proxies):
+                # finished accounts are deleted from database, only account cache remembers them
+                if self.storage.get_account_cache(address).get("completed"):
+                    if not readd_completed:
+                        completed_amount += 1
+                        continue
+                    self.storage.update_account_cache(address, {"completed": None})
+
+                new_modules[encoded_pk] = {
+                    "address": address,
+                    "modules": [{"module_name": "opinion", "status": "to_run"} for _ in range(randint(*BID_AMOUNTS))],
+                    "proxy": proxy,
+                    "label": label,
+                }
+            changes.update(new_modules)
+
+        self.state.update_many(changes)
+        self.update_accounts_modules_done(new_modules=new_modules, removed_addresses=retired_addresses)
+
+        self.get_amounts()
+        logger.info(
+            f'Synced Database: added {len(new_modules)} accounts, retired {len(retired_addresses)} accounts, '
+            f'updated {len(changes) - len(new_modules) - len(retired_addresses)} accounts, '
+            f'skipped {completed_amount} completed accounts\n'
+        )
+
+
+    def get_input_proxies(self, amount: int):
+        with open('input_data/proxies.txt') as f:
+            proxies = f.read().splitlines()
+
+        if len(proxies) == 0 or proxies == [""] or proxies == ["http://login:password@ip:port"]:
+            logger.error('You will not use proxy')
+            return [None for _ in range(amount)]
+        else:
+            return list(proxies * (amount // len(proxies) + 1))[:amount]
+
+
+    def prepare_accounts(self, raw_pkeys: Iterable[str], keys_amount: int):
+        started = time()
+        with ProcessPoolExecutor(
+                max_workers=min(cpu_count() or 1, max(1, keys_amount // 50)),
+                initializer=init_encrypt_worker,
+                initargs=(self.personal_key,),
+        ) as pool:
+            accounts = list(tqdm(
+                pool.map(
+                    prepare_account,
+                    raw_pkeys,
+                    chunksize=max(1, min(256, keys_amount // (cpu_count() or 1) // 4)),
+                ),
+                total=keys_amount,
+                desc="Encrypting privatekeys",
+                unit="key",
+            ))
+
+        elapsed = max(time() - started, 1e-6)
+        logger.info(f'Prepared {len(accounts)} privatekeys in {round(elapsed, 1)}s ({round(len(accounts) / elapsed)} keys/sec)')
+        return accounts
+
+
     def get_amounts(self):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        modules_len = sum([len(modules_db[acc]["modules"]) for acc in modules_db])
-        if modules_db and list(modules_db.values())[0].get("group_number"):
+        counts = self.state.get_counts()
+        if counts["is_groups"]:
             modules_name = "groups_amount"
         else:
             modules_name = "accs_amount"
 
-        for acc in modules_db:
-            for index, module in enumerate(modules_db[acc]["modules"]):
-                if module["status"] in ["failed", "cloudflare"]: modules_db[acc]["modules"][index]["status"] = "to_run"
+        if self.window_name == None and self.counters is not None:
+            self.window_name = SharedWindowName(accs_amount=counts["entries"], counters=self.counters)
+        elif self.window_name == None: self.window_name = WindowName(accs_amount=counts["entries"])
+        else: self.window_name.accs_amount = counts["entries"]
+        self.window_name.set_modules(modules_amount=counts["modules"])
 
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f:
-            json.dump(modules_db, f)
+        return {modules_name: counts["entries"], 'modules_amount': counts["modules"]}
 
-        if self.window_name == None: self.window_name = WindowName(accs_amount=len(modules_db))
-        else: self.window_name.accs_amount = len(modules_db)
-        self.window_name.set_modules(modules_amount=modules_len)
 
-        return {modules_name: len(modules_db), 'modules_amount': modules_len}
+    def reset_failed_modules(self):
+        if DATABASE_LEASES["enabled"]:
+            # other hosts may be running these accounts, so only module rows are updated
+            self.state.drop_cache()
+            self.storage.reset_statuses(["failed", "cloudflare"])
+        else:
+            self.state.reset_statuses(["failed", "cloudflare"])
 
 
     def get_all_modules(self, unique_wallets: bool = False):
         self.get_password()
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
+        if not self.shard: # main process resets them for all shards before start
+            self.reset_failed_modules()
+        modules_db = self.state.load()
 
         if not modules_db:
             return 'No more accounts left'
         elif list(modules_db.values())[0].get("group_number"):
             raise DataBaseError(f'Unexpected database type for this mode')
 
-        all_wallets_modules = [
-            {
-                'privatekey': self.decode_pk(pk=encoded_privatekey),
-                'encoded_privatekey': encoded_privatekey,
-                'proxy': wallet_data.get("proxy"),
-                'address': wallet_data["address"],
-                'label': wallet_data["label"],
-                'module_info': module_info,
-                'last': module_index + 1 == len(modules_db[encoded_privatekey]["modules"])
-            }
-            for encoded_privatekey, wallet_data in modules_db.items()
-            for module_index, module_info in enumerate(modules_db[encoded_privatekey]["modules"])
-            if (
-                    module_info["status"] == "to_run" and
-                    (not unique_wallets or module_index + 1 == len(modules_db[encoded_privatekey]["modules"]))
-            )
-        ]
+        all_wallets_modules = ModulesQueue()
+        for encoded_privatekey, wallet_data in modules_db.items():
+            if not self.in_shard(encoded_privatekey): continue
+            module_names = [
+                module_info["module_name"]
+                for module_index, module_info in enumerate(wallet_data["modules"])
+                if (
+                        module_info["status"] == "to_run" and
+                        (not unique_wallets or module_index + 1 == len(wallet_data["modules"]))
+                )
+            ]
+            if module_names:
+                all_wallets_modules.add_account(
+                    account=Account(
+                        encoded_privatekey=encoded_privatekey,
+                        address=wallet_data["address"],
+                        proxy=wallet_data.get("proxy"),
+                        label=wallet_data["label"],
+                    ),
+                    module_names=module_names,
+                )
+
         if SHUFFLE_WALLETS:
-            shuffle(all_wallets_modules)
+            all_wallets_modules.shuffle()
         return all_wallets_modules
 
 
     def get_all_groups(self):
         self.get_password()
-
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
+        self.reset_failed_modules()
+        modules_db = self.state.load()
 
         if not modules_db:
             return 'No more accounts left'
@@ -283,131 +589,199 @@ class DataBase:
             raise DataBaseError(f'Unexpected database type for this mode')
 
         all_groups = [
-            {
-                "group_index": group_index,
-                "group_number": group_data["group_number"],
-                "module_info": group_data["modules"][0],
-                "wallets_data": [
-                    {
-                        "encoded_privatekey": wallet_data["encoded_privatekey"],
-                        "privatekey": self.decode_pk(wallet_data["encoded_privatekey"]),
-                        "address": wallet_data["address"],
-                        "proxy": wallet_data["proxy"],
-                        "label": wallet_data["label"],
-                    }
+            GroupTask(
+                group_index=group_index,
+                group_number=group_data["group_number"],
+                module_name=group_data["modules"][0]["module_name"],
+                wallets=[
+                    Account(
+                        encoded_privatekey=wallet_data["encoded_privatekey"],
+                        address=wallet_data["address"],
+                        proxy=wallet_data["proxy"],
+                        label=wallet_data["label"],
+                    )
                     for wallet_data in group_data["wallets_data"]
                 ]
-            }
+            )
             for group_index, group_data in modules_db.items()
             if group_data["modules"][0]["status"] == "to_run"
         ]
         return all_groups
 
 
-    async def remove_account(self, module_data: dict):
+    def get_lease_queue(self, unique_wallets: bool = False, is_groups: bool = False):
+        if DATABASE_ENGINE != "sqlite":
+            raise DataBaseError(f'DATABASE_LEASES works only with DATABASE_ENGINE = "sqlite"')
+
+        self.get_password()
+        if not self.shard:
+            self.reset_failed_modules()
+        counts = self.state.get_counts()
+        if counts["entries"] and counts["is_groups"] != is_groups:
+            raise DataBaseError(f'Unexpected database type for this mode')
+
+        return LeaseQueue(
+            db=self,
+            worker=f'{gethostname()}-{getpid()}',
+            unique_wallets=unique_wallets,
+            shuffled=SHUFFLE_WALLETS and not is_groups,
+            lease_seconds=DATABASE_LEASES["seconds"],
+        )
+
+
+    async def claim_task(self, worker: str, unique_wallets: bool, shuffled: bool):
         async with self.changes_lock:
-            with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
+            claimed = await self.run_io(self.storage.claim, worker, DATABASE_LEASES["seconds"], unique_wallets, shuffled)
+            if claimed is None:
+                return None
+
+            # another host could change this entry since it was loaded
+            key, module_name = claimed
+            entry = await self.run_io(self.storage.get, key)
+            if entry.get("group_number") is None:
+                stats = await self.run_io(self.storage.get_stats, [entry["address"]])
+            else:
+                stats = {}
+            self.state.refresh(key, entry, stats)
+
+        if entry.get("group_number") is None:
+            return ModuleTask(
+                account=Account(
+                    encoded_privatekey=key,
+                    address=entry["address"],
+                    proxy=entry.get("proxy"),
+                    label=entry["label"],
+                ),
+                module_name=module_name,
+            )
+        return GroupTask(
+            group_index=key,
+            group_number=entry["group_number"],
+            module_name=module_name,
+            wallets=[
+                Account(
+                    encoded_privatekey=wallet_data["encoded_privatekey"],
+                    address=wallet_data["address"],
+                    proxy=wallet_data["proxy"],
+                    label=wallet_data["label"],
+                )
+                for wallet_data in entry["wallets_data"]
+            ]
+        )
 
+
+    async def has_pending_tasks(self, unique_wallets: bool):
+        return await self.run_io(self.storage.has_pending, unique_wallets)
+
+
+    async def extend_lease(self, worker: str, task: ModuleTask | GroupTask):
+        return await self.run_io(self.storage.extend_lease, worker, task.addresses, DATABASE_LEASES["seconds"])
+
+
+    async def release_task(self, worker: str, task: ModuleTask | GroupTask):
+        # results must be in the database before another worker can claim this address
+        await self.state.checkpoint_async()
+        await self.run_io(self.storage.release, worker, task.addresses)
+
+
+    async def remove_account(self, module_task: ModuleTask):
+        async with self.changes_lock:
             self.window_name.add_acc()
-            if module_data["module_info"]["status"] in [True, "completed"]:
-                del modules_db[module_data["encoded_privatekey"]]
+            if module_task.status in [True, "completed"]:
+                await self.state.delete(module_task.encoded_privatekey)
             else:
-                modules_db[module_data["encoded_privatekey"]]["modules"] = [
+                account_data = self.state.get(module_task.encoded_privatekey)
+                account_data["modules"] = [
                     {**module, "status": "failed"}
-                    for module in modules_db[module_data["encoded_privatekey"]]["modules"]
+                    for module in account_data["modules"]
                 ]
+                await self.state.put(module_task.encoded_privatekey, account_data)
 
-            with open(self.modules_db_name, 'w', encoding="utf-8") as f:
-                json.dump(modules_db, f)
-            return True
+        if module_task.status in [True, "completed"]:
+            await self.update_account_cache(module_task.address, completed=True)
+        return True
 
 
-    async def remove_module(self, module_data: dict):
+    async def remove_module(self, module_task: ModuleTask):
         async with self.changes_lock:
-            with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
+            account_data = self.state.get(module_task.encoded_privatekey)
 
-            for index, module in enumerate(modules_db[module_data["encoded_privatekey"]]["modules"]):
-                if module["module_name"] == module_data["module_info"]["module_name"] and module["status"] == "to_run":
+            for index, module in enumerate(account_data["modules"]):
+                if module["module_name"] == module_task.module_name and module["status"] == "to_run":
                     self.window_name.add_module()
 
-                    if module_data["module_info"]["status"] in [True, "completed"]:
-                        modules_db[module_data["encoded_privatekey"]]["modules"].remove(module)
+                    if module_task.status in [True, "completed"]:
+                        account_data["modules"].remove(module)
                     else:
-                        modules_db[module_data["encoded_privatekey"]]["modules"][index]["status"] = "failed"
+                        account_data["modules"][index]["status"] = "failed"
                     break
 
             if [
                 module["status"]
-                for module in modules_db[module_data["encoded_privatekey"]]["modules"]
+                for module in account_data["modules"]
             ].count('to_run') == 0:
                 self.window_name.add_acc()
                 last_module = True
             else:
                 last_module = False
 
-            if not modules_db[module_data["encoded_privatekey"]]["modules"]:
-                del modules_db[module_data["encoded_privatekey"]]
+            if not account_data["modules"]:
+                await self.state.delete(module_task.encoded_privatekey)
+            else:
+                await self.state.put(module_task.encoded_privatekey, account_data)
 
-            with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(modules_db, f)
-            return last_module
+        if not account_data["modules"]:
+            await self.update_account_cache(account_data["address"], completed=True)
+        return last_module
 
 
-    async def remove_group(self, group_data: dict):
+    async def remove_group(self, group_task: GroupTask):
         async with self.changes_lock:
-            with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-
             self.window_name.add_acc()
-            if group_data["module_info"]["status"] in [True, "completed"]:
-                del modules_db[group_data["group_index"]]
+            if group_task.status in [True, "completed"]:
+                await self.state.delete(group_task.group_index)
 
             else:
-                modules_db[group_data["group_index"]]["modules"] = [{
-                    "module_name": group_data["module_info"]["module_name"],
+                group_entry = self.state.get(group_task.group_index)
+                group_entry["modules"] = [{
+                    "module_name": group_task.module_name,
                     "status": "failed"
                 }]
-
-            with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(modules_db, f)
+                await self.state.put(group_task.group_index, group_entry)
             return True
 
 
     def set_accounts_modules_done(self, new_modules: dict):
-        with open(self.stats_db_name, encoding="utf-8") as f: stats_db = json.load(f)
-        stats_db["modules_done"] = {
+        self.state.replace_stats({
             v["address"]: [0, len(v["modules"])]
             for k, v in new_modules.items()
-        }
-        with open(self.stats_db_name, 'w', encoding="utf-8") as f: json.dump(stats_db, f)
+        })
 
 
-    def increase_account_modules_done(self, address: str):
-        with open(self.stats_db_name, encoding="utf-8") as f: stats_db = json.load(f)
-        modules_done = stats_db["modules_done"].get(address)
+    def update_accounts_modules_done(self, new_modules: dict, removed_addresses: list):
+        self.state.update_stats({
+            **{address: None for address in removed_addresses},
+            **{
+                account_data["address"]: [0, len(account_data["modules"])]
+                for account_data in new_modules.values()
+            },
+        })
+
+
+    async def increase_account_modules_done(self, address: str):
+        modules_done = self.state.get_stat(address)
         if modules_done is None:
             return None
-        modules_done[0] += 1
-        if modules_done[0] == modules_done[1]:
-            del stats_db["modules_done"][address]
-        else:
-            stats_db["modules_done"][address] = modules_done
 
-        with open(self.stats_db_name, 'w', encoding="utf-8") as f: json.dump(stats_db, f)
+        modules_done = [modules_done[0] + 1, modules_done[1]]
+        await self.state.set_stat(address, None if modules_done[0] == modules_done[1] else modules_done)
         return modules_done
 
 
     async def append_report(self, encoded_pk: str, text: str, success: bool = None):
         async with self.changes_lock:
             status_smiles = {True: '✅ ', False: "❌ ", None: ""}
-
-            with open(self.report_db_name, encoding="utf-8") as f: report_db = json.load(f)
-
-            if not report_db.get(encoded_pk): report_db[encoded_pk] = {'texts': [], 'success_rate': [0, 0]}
-
-            report_db[encoded_pk]["texts"].append(status_smiles[success] + text)
-            if success != None:
-                report_db[encoded_pk]["success_rate"][1] += 1
-                if success == True: report_db[encoded_pk]["success_rate"][0] += 1
-
-            with open(self.report_db_name, 'w') as f: json.dump(report_db, f)
+            await self.run_io(self.reports.append, encoded_pk, status_smiles[success] + text, success)
 
 
     async def get_account_reports(
@@ -419,33 +793,33 @@ class DataBase:
             address: str = None,
             get_rate: bool = False,
     ):
-        async with self.changes_lock:
-            with open(self.report_db_name, encoding="utf-8") as f: report_db = json.load(f)
+        header_string = ""
+        if last_module:
+            header_string += f"[{self.window_name.accs_done}/{self.window_name.accs_amount}] "
+        header_string += f"<b>{label}</b>"
 
-            header_string = ""
-            if last_module:
-                header_string += f"[{self.window_name.accs_done}/{self.window_name.accs_amount}] "
-            header_string += f"<b>{label}</b>"
+        if mode == 1:
+            modules_done = await self.increase_account_modules_done(address=address)
+            if modules_done:
+                header_string += f"\n📌 [Trade {modules_done[0]}/{modules_done[1]}]"
 
-            if mode == 1:
-                modules_done = self.increase_account_modules_done(address=address)
-                if modules_done:
-                    header_string += f"\n📌 [Trade {modules_done[0]}/{modules_done[1]}]"
+        if header_string:
+            header_string += "\n\n"
 
-            if header_string:
-                header_string += "\n\n"
-
-            if report_db.get(key):
-                account_reports = report_db[key]
-                if get_rate: return f'{account_reports["success_rate"][0]}/{account_reports["success_rate"][1]}'
-                del report_db[key]
-
-                with open(self.report_db_name, 'w', encoding="utf-8") as f: json.dump(report_db, f)
+        async with self.changes_lock:
+            account_records = await self.run_io(self.reports.get, key)
+            if account_records:
+                success_rate = [
+                    len([record for record in account_records if record["success"] is True]),
+                    len([record for record in account_records if record["success"] is not None]),
+                ]
+                if get_rate: return f'{success_rate[0]}/{success_rate[1]}'
+                await self.run_io(self.reports.remove, key)
 
-                logs_text = '\n'.join(account_reports['texts'])
+                logs_text = '\n'.join([record["text"] for record in account_records])
                 tg_text = f'{header_string}{logs_text}'
-                if account_reports["success_rate"][1]:
-                    tg_text += f'\n\nSuccess rate {account_reports["success_rate"][0]}/{account_reports["success_rate"][1]}'
+                if success_rate[1]:
+                    tg_text += f'\n\nSuccess rate {success_rate[0]}/{success_rate[1]}'
 
                 return tg_text
 
@@ -8,7 +8,9 @@ import asyncio
 from modules.utils import round_cut, async_sleep, make_border, TgReport
 from modules.retry import CustomError, retry
 from modules.browser import Browser
+from modules.orders import OrderWatcher, TrackedOrder, is_filled, get_filled_share
 from modules.wallet import Wallet
+from modules.tasks import GroupTask
 from settings import (
     SLEEP_BETWEEN_CLOSE_ORDERS,
     SLEEP_BETWEEN_OPEN_ORDERS,
@@ -19,6 +21,8 @@ from settings import (
     BID_SETTINGS,
     SELL_SETTINGS,
     BID_TYPES,
+    ORDER_WATCHER,
+    BALANCE_SECONDS,
 )
 
 
@@ -52,23 +56,27 @@ class Opinion:
             "signatureType": "2",
         },
     }
+    STALE_INFO_ERRORS: list = ["approve", "allowance", "maker", "signer", "register", "proxy wallet"]
 
-    def __init__(self, wallet: Wallet, browser: Browser, label: str, group_data: dict = None):
+    def __init__(self, wallet: Wallet, browser: Browser, label: str, group: GroupTask = None):
         self.wallet = wallet
         self.browser = browser
         self.encoded_pkey = wallet.encoded_pk
         self.label = label
 
-        if group_data:
-            self.group_number = group_data["group_number"]
-            self.encoded_pkey = group_data["group_index"]
+        if group:
+            self.group_number = group.group_number
+            self.encoded_pkey = group.group_index
             self.prefix = f"[<i>{label}</i>] "
         else:
             self.group_number = None
             self.prefix = ""
 
         self.profile_info = None
+        self.profile_info_ts = 0
+        self.account_info = None
         self.proxy_wallet = None
+        self.order_watcher = OrderWatcher(browser)
 
 
     @retry(source="Opinion")
@@ -92,7 +100,31 @@ class Opinion:
 
 
     async def login(self):
-        if not await self.browser.is_user_registered():
+        account_cache = await self.wallet.db.get_account_cache(self.wallet.address)
+        self.account_info = self.wallet.db.get_account_info(account_cache)
+
+        token = self.wallet.db.get_session_token(account_cache)
+        if token:
+            self.browser.set_token(token)
+        else:
+            await self.sign_in()
+        self.browser.relogin = self.sign_in
+
+        if self.account_info:
+            self.proxy_wallet = self.account_info["proxy_wallet"]
+            return
+
+        await self.update_profile_info()
+        self.proxy_wallet = self.profile_info["multiSignedWalletAddress"].get("56")
+        if not self.proxy_wallet:
+            raise CustomError(f'No proxy wallet created for {self.label}')
+        elif not await self.browser.is_approved(self.proxy_wallet):
+            raise CustomError(f"Wallet {self.label} is not approved")
+        await self.wallet.db.save_account_info(self.wallet.address, proxy_wallet=self.proxy_wallet)
+
+
+    async def sign_in(self):
+        if not self.account_info and not await self.browser.is_user_registered():
             raise CustomError(f"User {self.label} is not registered")
 
         date_now = datetime.now(timezone.utc)
@@ -109,19 +141,13 @@ Nonce: {nonce}
 Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
         signature = self.wallet.sign_message(sign_message).removeprefix("0x")
 
-        await self.browser.user_login(
+        token = await self.browser.user_login(
             sign_message,
             signature,
             int(date_now.timestamp()),
             nonce,
         )
-
-        self.profile_info = await self.browser.get_profile_info()
-        self.proxy_wallet = self.profile_info["multiSignedWalletAddress"].get("56")
-        if not self.proxy_wallet:
-            raise CustomError(f'No proxy wallet created for {self.label}')
-        elif not await self.browser.is_approved(self.proxy_wallet):
-            raise CustomError(f"Wallet {self.label} is not approved")
+        await self.wallet.db.save_session_token(self.wallet.address, token)
 
 
     async def buy_sell_position(self):
@@ -188,6 +214,8 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
 
 
     async def parse(self):
+        if self.profile_info is None:
+            await self.update_profile_info()
         balance = round(float(self.profile_info["balance"][0]["balance"]), 2)
         profit = round(float(self.profile_info["totalProfit"]), 2)
         volume = round(float(self.profile_info["Volume"]), 2)
@@ -286,24 +314,17 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
             self.log_message(f"Sleep {to_sleep}s before {order_side}")
             await async_sleep(to_sleep)
 
+        if order_type not in ["market", "limit"]:
+            raise CustomError(f'Unsupported order type `{order_type}`')
+
         if order_side == "buy":
             side = 0
-            if not event:
-                event = await self.browser.get_events()
-                if not event:
-                    raise Exception(f'No events found')
-
-            if usd_amount:
-                amount = usd_amount
-            else:
-                amount = float(await self.calculate_order_amount())
+            # the event with its book and the balance do not depend on each other
+            (event, event_choice_index, book), amount = await asyncio.gather(
+                self.prefetch_buy_event(event, force_vote),
+                self.get_buy_amount(usd_amount),
+            )
             usd_amount = amount
-            if force_vote is not None:
-                event_choice_index = force_vote
-            elif event.get("force_vote"):
-                event_choice_index = event["force_vote"] - 1
-            else:
-                event_choice_index = choice([0, 1])
             token_id = event["tokens"][event_choice_index]
             label = event["labels"][event_choice_index]
 
@@ -321,12 +342,16 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
                         "vote": position["outcomeSide"],
                     },
                 )
+                book = await self.get_order_book(event, event_choice_index)
 
             elif order and event:
                 event_choice_index = order["outcomeSide"] - 1
-                position = await self.browser.get_position(
-                    topic_id=event["raw_event"]["topicId"],
-                    outcome_side=order["outcomeSide"]
+                position, book = await asyncio.gather(
+                    self.browser.get_position(
+                        topic_id=event["raw_event"]["topicId"],
+                        outcome_side=order["outcomeSide"]
+                    ),
+                    self.get_order_book(event, event_choice_index),
                 )
                 if not position:
                     raise Exception(f'Failed to found active position "{event["name"]}"')
@@ -346,59 +371,198 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
         else:
             raise Exception(f'Unsupported order_side: `{order_side}`')
 
-        book = await self.browser.get_event_book(
+        tracked_order = TrackedOrder(
+            order_side=order_side,
+            order_type=order_type,
+            side=side,
+            event=event,
+            event_choice_index=event_choice_index,
+            token_id=token_id,
+            label=label,
+            amount=amount,
+            usd_amount=usd_amount,
+            holding=holding,
+        )
+        await self.submit_order(tracked_order, self.sign_order(tracked_order, book), action_name=action_name)
+
+        # placed -> resting -> (repricing -> placed ...) -> filled, one order alive at a time
+        try:
+            filled_order = None
+            while not tracked_order.is_done:
+                if tracked_order.state == "placed":
+                    await self.on_order_placed(tracked_order, book)
+                    tracked_order.move("resting")
+
+                elif tracked_order.state == "resting":
+                    filled_order = await self.order_watcher.wait(tracked_order.trans_no, timeout=self.get_order_timeout(tracked_order))
+                    if filled_order:
+                        tracked_order.move("filled")
+                        continue
+
+                    if not tracked_order.holding and time() < tracked_order.deadline:
+                        continue
+                    book = await self.get_order_book(tracked_order.event, tracked_order.event_choice_index)
+                    if await self.should_reprice(tracked_order, book):
+                        tracked_order.move("repricing")
+
+                elif tracked_order.state == "repricing":
+                    last_seen = self.order_watcher.last_seen(tracked_order.trans_no)
+                    self.order_watcher.forget(tracked_order.trans_no)
+                    # the new order is signed while the cancel is in flight, the fill is checked after the cancel
+                    signed_order, cancelled_order = await asyncio.gather(
+                        asyncio.to_thread(self.sign_order, tracked_order, book),
+                        self.cancel_tracked_order(tracked_order, last_seen),
+                    )
+                    if cancelled_order and is_filled(cancelled_order):
+                        filled_order = cancelled_order
+                        tracked_order.move("filled")
+                        continue
+
+                    self.log_message(f'Cancelled order in "{event["name"]}"', level="INFO")
+                    if cancelled_order and get_filled_share(cancelled_order):
+                        filled_share = tracked_order.record_fill(cancelled_order)
+                        self.log_message(f"Limit order is {round(filled_share * 100, 1)}% filled, placing the rest")
+                        signed_order = self.sign_order(tracked_order, book)
+                    await self.submit_order(tracked_order, signed_order, action_name=action_name)
+
+        finally:
+            if tracked_order.state == "repricing":
+                tracked_order.move("cancelled")
+            if tracked_order.state != "filled":
+                self.order_watcher.forget(tracked_order.trans_no)
+            if tracked_order.order_type == "limit":
+                self.log_message(f"Order metrics: {tracked_order.metrics()}")
+
+        # parts filled before repricing count too
+        filled_order = tracked_order.total_fill(filled_order)
+        final_price = round(float(filled_order["price"]) * 100, 2)
+        total_price = round_cut(filled_order["totalPrice"], 2)
+        self.log_message(f"Filled {order_type} {order_side} order for <green>{total_price}$ at {final_price}¢</green>", level="INFO")
+        await self.wallet.db.append_report(
+            encoded_pk=self.encoded_pkey,
+            text=f"{self.prefix}{order_type} {order_side} «{label}» for {total_price if tracked_order.filled_amount else usd_amount}$ at {final_price}¢ in «{event['name']}»",
+            success=True
+        )
+
+        return {
+            "order": filled_order,
+            "event": event,
+        }
+
+
+    async def cancel_tracked_order(self, tracked_order: TrackedOrder, last_seen: dict | None):
+        await self.browser.cancel_order(tracked_order.trans_no)
+        cancelled_order = await self.browser.get_orders(
+            topic_id=tracked_order.event["raw_event"]["topicId"],
+            trans_no=tracked_order.trans_no,
+            is_parent=tracked_order.event["is_child"],
+            order_type="market",
+        )
+        # final fill is unknown, rely on the last seen one at least
+        return cancelled_order or last_seen
+
+
+    async def prefetch_buy_event(self, event: dict | None, force_vote: int | None):
+        if not event:
+            event = await self.browser.get_events()
+            if not event:
+                raise Exception(f'No events found')
+
+        if force_vote is not None:
+            event_choice_index = force_vote
+        elif event.get("force_vote"):
+            event_choice_index = event["force_vote"] - 1
+        else:
+            event_choice_index = choice([0, 1])
+
+        return event, event_choice_index, await self.get_order_book(event, event_choice_index)
+
+
+    async def get_buy_amount(self, usd_amount: float | None):
+        if usd_amount:
+            return usd_amount
+        return float(await self.calculate_order_amount())
+
+
+    async def get_order_book(self, event: dict, event_choice_index: int):
+        return await self.browser.get_event_book(
             question_id=event["raw_event"]["questionId"],
             symbol=event["raw_event"]["yesPos" if event_choice_index == 0 else "noPos"],
             event_choice_index=event_choice_index,
         )
-        if order_type == "market":
-            price = book["asks" if order_side == "buy" else "bids"][0]
-            taker_amount = 0
 
-        elif order_type == "limit":
-            price = self._calculate_limit_price(order_side, book, holding)
 
-            if order_side == "buy":
+    def sign_order(self, tracked_order: TrackedOrder, book: dict):
+        amount = tracked_order.amount
+        if tracked_order.order_type == "market":
+            price = book["asks" if tracked_order.order_side == "buy" else "bids"][0]
+            taker_amount = 0
+        else:
+            price = self._calculate_limit_price(tracked_order.order_side, book, tracked_order.holding)
+            if tracked_order.order_side == "buy":
                 taker_amount = float(round_cut(amount / price, 2))
                 amount = float(Decimal(str(taker_amount)) * Decimal(str(price)))
             else:
                 taker_amount = float(Decimal(str(amount)) * Decimal(str(price)))
 
-        else:
-            raise CustomError(f'Unsupported order type `{order_type}`')
+        typed_data = {
+            **self.TYPED_DATA,
+            "message": {
+                **self.TYPED_DATA["message"],
+                "salt": str(int(random() * int(time() * 1e3))),
+                "maker": self.proxy_wallet,
+                "signer": self.wallet.address,
+                "tokenId": tracked_order.token_id,
+                "makerAmount": str(int(Decimal(str(amount)) * Decimal('1e18'))),
+                "takerAmount": str(int(Decimal(str(taker_amount)) * Decimal('1e18'))),
+                "side": str(tracked_order.side),
+            },
+        }
+        return {
+            "price": price,
+            "message": typed_data["message"],
+            "signature": self.wallet.sign_message(typed_data=typed_data),
+        }
 
-        typed_data = self.TYPED_DATA.copy()
-        typed_data["message"].update({
-            "salt": str(int(random() * int(time() * 1e3))),
-            "maker": self.proxy_wallet,
-            "signer": self.wallet.address,
-            "tokenId": token_id,
-            "makerAmount": str(int(Decimal(str(amount)) * Decimal('1e18'))),
-            "takerAmount": str(int(Decimal(str(taker_amount)) * Decimal('1e18'))),
-            "side": str(side),
-        })
-        signature = self.wallet.sign_message(typed_data=typed_data)
 
+    async def submit_order(self, tracked_order: TrackedOrder, signed_order: dict, action_name: str):
+        price = signed_order["price"]
         self.log_message(
-            f'{action_name} <green>{usd_amount} USDT</green> for {label} in <blue>{event["name"]}</blue> <green>at {round(price * 100, 2)}¢</green>',
+            f'{action_name} <green>{tracked_order.usd_amount} USDT</green> for {tracked_order.label} in <blue>{tracked_order.event["name"]}</blue> <green>at {round(price * 100, 2)}¢</green>',
             level="INFO"
         )
-        order_data = await self.browser.create_order(
-            typed_message=typed_data["message"],
-            signature=signature,
-            event_id=event["raw_event"]["topicId"],
-            safe_rate="0" if (order_side == "buy" and order_type == "market") else "0.05",
-            price=str(price) if order_type == "limit" else "0"
+        try:
+            order_data = await self.browser.create_order(
+                typed_message=signed_order["message"],
+                signature=signed_order["signature"],
+                event_id=tracked_order.event["raw_event"]["topicId"],
+                safe_rate="0" if (tracked_order.order_side == "buy" and tracked_order.order_type == "market") else "0.05",
+                price=str(price) if tracked_order.order_type == "limit" else "0"
+            )
+        except Exception as err:
+            if self.account_info and any(error_text in str(err).lower() for error_text in self.STALE_INFO_ERRORS):
+                # saved proxy wallet or approve may be outdated, check them again on next login
+                await self.wallet.db.drop_account_info(self.wallet.address)
+                self.account_info = None
+            raise
+
+        self.profile_info = None
+        tracked_order.trans_no = order_data["transNo"]
+        tracked_order.price = price
+        tracked_order.move("placed")
+        self.order_watcher.watch(
+            trans_no=tracked_order.trans_no,
+            topic_id=tracked_order.event["raw_event"]["topicId"],
+            is_parent=tracked_order.event["is_child"],
         )
 
+
+    async def on_order_placed(self, tracked_order: TrackedOrder, book: dict):
+        order_side, order_type = tracked_order.order_side, tracked_order.order_type
         if order_type == "limit":
-            to_wait_sec = LIMIT_SETTINGS[f"to_wait_{order_side}"] * 60
-            deadline_ts = int(time()) + to_wait_sec
-            minutes_str = f"{LIMIT_SETTINGS[f'to_wait_{order_side}']} minute{'s' if LIMIT_SETTINGS[f'to_wait_{order_side}'] > 1 else ''}"
-        else:
-            minutes_str = ""
+            tracked_order.deadline = time() + LIMIT_SETTINGS[f"to_wait_{order_side}"] * 60
 
-        if holding:
+        if tracked_order.holding:
             limit_last_price = book["bids" if order_side == "buy" else "asks"][0]
             multiplier = Decimal(-1 if order_side == "buy" else 1)
             range_prices = "-".join([
@@ -408,100 +572,74 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
             self.log_message(f"Waiting for last limit price will be out of range <white>{range_prices}</white> to change price")
             await self.wallet.db.append_report(
                 encoded_pk=self.encoded_pkey,
-                text=f"{self.prefix}open {order_type} {order_side} «{label}» for {usd_amount}$ at {round_cut(price * 100 , 2)}¢ in «{event['name']}»",
+                text=f"{self.prefix}open {order_type} {order_side} «{tracked_order.label}» for {tracked_order.usd_amount}$ at {round_cut(tracked_order.price * 100 , 2)}¢ in «{tracked_order.event['name']}»",
                 success=True
             )
-
         else:
-            self.log_message(f"Waiting for {order_type} {order_side} order filled" + (f" {minutes_str}" if minutes_str else ""))
-        while True:
-            filled_order = await self.browser.get_orders(
-                topic_id=event["raw_event"]["topicId"],
-                trans_no=order_data["transNo"],
-                is_parent=event["is_child"],
-                order_type="market",
-            )
+            self.log_message(f"Waiting for {order_type} {order_side} order filled" + (f" {self._wait_minutes_str(order_side)}" if order_type == "limit" else ""))
 
-            if filled_order and round(float(filled_order["filled"].split('/')[0]), 2)  == round(float(filled_order["filled"].split('/')[1]), 2):
-                final_price = round(float(filled_order["price"]) * 100, 2)
-                total_price = round_cut(filled_order["totalPrice"], 2)
-                self.log_message(f"Filled {order_type} {order_side} order for <green>{total_price}$ at {final_price}¢</green>", level="INFO")
-                await self.wallet.db.append_report(
-                    encoded_pk=self.encoded_pkey,
-                    text=f"{self.prefix}{order_type} {order_side} «{label}» for {usd_amount}$ at {final_price}¢ in «{event['name']}»",
-                    success=True
-                )
-                break
-
-            elif order_type == "limit":
-                if holding or time() > deadline_ts:
-                    book = await self.browser.get_event_book(
-                        question_id=event["raw_event"]["questionId"],
-                        symbol=event["raw_event"]["yesPos" if event_choice_index == 0 else "noPos"],
-                        event_choice_index=event_choice_index,
-                    )
-                    if holding:
-                        current_price = book["bids" if order_side == "buy" else "asks"][0]
-                        limits_diff = float(round_cut(abs(price - current_price) * 100, 1))
-                        if not LIMIT_HOLDING["price_max_offset"][0] <= limits_diff <= LIMIT_HOLDING["price_max_offset"][1]:
-                            self.log_message(f"Last limit price is {round_cut(current_price * 100, 1)}¢, changing limit price...")
-                            await self.wallet.db.append_report(
-                                encoded_pk=self.encoded_pkey,
-                                text=f"⚠️ changing limit price: last price <i>{round_cut(current_price * 100, 1)}¢</i>, current price <i>{round(price * 100, 2)}¢</i>",
-                            )
-                            reports = await self.wallet.db.get_account_reports(
-                                key=self.encoded_pkey,
-                                address=self.wallet.address,
-                                label=self.label,
-                                last_module=False,
-                                mode=5,
-                            )
-                            await TgReport().send_log(logs=reports)
-
-                            await self.browser.cancel_order(order_data["transNo"])
-                            self.log_message(f'Cancelled order in "{event["name"]}"', level="INFO")
-                            event["force_vote"] = event_choice_index + 1
-                            return await self.create_order(
-                                    order_side=order_side,
-                                    order_type=order_type,
-                                    holding=holding,
-                                    event=event,
-                                    usd_amount=usd_amount,
-                                    position=position,
-                            )
 
-                    else:
-                        if price == self._calculate_limit_price(order_side, book, holding):
-                            self.log_message(f"Limit order not filled in {minutes_str}, but price not changed, waiting again...")
-                            deadline_ts = int(time()) + to_wait_sec
-                        else:
-                            self.log_message(f"Limit order not filled in {minutes_str}, changing price...")
+    @classmethod
+    def _wait_minutes_str(cls, order_side: str):
+        minutes = LIMIT_SETTINGS[f"to_wait_{order_side}"]
+        return f"{minutes} minute{'s' if minutes > 1 else ''}"
 
-                            await self.browser.cancel_order(order_data["transNo"])
-                            self.log_message(f'Cancelled order in "{event["name"]}"', level="INFO")
 
-                            if order_side == "buy":
-                                event["force_vote"] = event_choice_index + 1
+    @classmethod
+    def get_order_timeout(cls, tracked_order: TrackedOrder):
+        if tracked_order.order_type != "limit":
+            return None
+        elif tracked_order.holding:
+            return ORDER_WATCHER["slow"]
+        return max(tracked_order.deadline - time(), 0)
 
-                            return await self.create_order(
-                                    order_side=order_side,
-                                    order_type=order_type,
-                                    event=event,
-                                    order=order,
-                                    position=position,
-                            )
 
-            await async_sleep(3)
+    async def should_reprice(self, tracked_order: TrackedOrder, book: dict):
+        order_side = tracked_order.order_side
+        current_price = book["bids" if order_side == "buy" else "asks"][0]
+        tracked_order.record_drift(current_price)
 
-        return {
-            "order": filled_order,
-            "event": event,
-        }
+        if tracked_order.holding:
+            limits_diff = float(round_cut(abs(tracked_order.price - current_price) * 100, 1))
+            if LIMIT_HOLDING["price_max_offset"][0] <= limits_diff <= LIMIT_HOLDING["price_max_offset"][1]:
+                return False
+
+            self.log_message(f"Last limit price is {round_cut(current_price * 100, 1)}¢, changing limit price...")
+            await self.wallet.db.append_report(
+                encoded_pk=self.encoded_pkey,
+                text=f"⚠️ changing limit price: last price <i>{round_cut(current_price * 100, 1)}¢</i>, current price <i>{round(tracked_order.price * 100, 2)}¢</i>",
+            )
+            reports = await self.wallet.db.get_account_reports(
+                key=self.encoded_pkey,
+                address=self.wallet.address,
+                label=self.label,
+                last_module=False,
+                mode=5,
+            )
+            await TgReport().send_log(logs=reports)
+            return True
+
+        minutes_str = self._wait_minutes_str(order_side)
+        if tracked_order.price == self._calculate_limit_price(order_side, book, tracked_order.holding):
+            self.log_message(f"Limit order not filled in {minutes_str}, but price not changed, waiting again...")
+            tracked_order.deadline = time() + LIMIT_SETTINGS[f"to_wait_{order_side}"] * 60
+            return False
+
+        self.log_message(f"Limit order not filled in {minutes_str}, changing price...")
+        return True
+
+
+    async def update_profile_info(self):
+        self.profile_info = await self.browser.get_profile_info()
+        self.profile_info_ts = time()
+        return self.profile_info
 
 
     async def get_balance(self):
-        profile_info = await self.browser.get_profile_info()
-        return float(profile_info["balance"][0]["balance"])
+        # balance from login is reused until the next order changes it
+        if self.profile_info is None or time() - self.profile_info_ts > BALANCE_SECONDS:
+            await self.update_profile_info()
+        return float(self.profile_info["balance"][0]["balance"])
 
 
     async def calculate_order_amount(self):
@@ -552,10 +690,10 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
 
 
 class PairAccounts:
-    def __init__(self, accounts: list[Opinion], group_data: dict):
+    def __init__(self, accounts: list[Opinion], group: GroupTask):
         self.accounts = accounts
-        self.group_number = f"Group {group_data['group_number']}"
-        self.group_index = group_data["group_index"]
+        self.group_number = f"Group {group.group_number}"
+        self.group_index = group.group_index
 
 
     async def run(self):
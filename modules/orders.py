@@ -0,0 +1,211 @@
+from dataclasses import dataclass, field
+from time import time
+import asyncio
+
+from modules.browser import Browser
+from modules.utils import round_cut
+from settings import ORDER_WATCHER
+
+
+def is_filled(order: dict):
+    filled, total = order["filled"].split('/')
+    return round(float(filled), 2) == round(float(total), 2)
+
+
+def get_filled_share(order: dict):
+    filled, total = order["filled"].split('/')
+    return min(float(filled) / float(total), 1) if float(total) else 0
+
+
+@dataclass(slots=True)
+class TrackedOrder:
+    TRANSITIONS = {
+        "new": ("placed",),
+        "placed": ("resting",),
+        "resting": ("filled", "repricing"),
+        "repricing": ("placed", "filled", "cancelled"),
+        "filled": (),
+        "cancelled": (),
+    }
+
+    order_side: str
+    order_type: str
+    side: int
+    event: dict
+    event_choice_index: int
+    token_id: str
+    label: str
+    amount: float
+    usd_amount: float | str
+    holding: bool = False
+
+    state: str = "new"
+    trans_no: str | None = None
+    price: float | None = None
+    deadline: float = 0
+    created: float = field(default_factory=time)
+    filled_in: float | None = None
+    reprices: int = 0
+    book_checks: int = 0
+    drift_sum: float = 0
+    drift_max: float = 0
+    # fills of the orders cancelled while repricing
+    filled_amount: float = 0
+    filled_price: float = 0
+
+    @property
+    def is_done(self): return self.state in ["filled", "cancelled"]
+
+
+    def move(self, state: str):
+        if state not in self.TRANSITIONS[self.state]:
+            raise Exception(f'Order {self.trans_no} can not move from `{self.state}` to `{state}`')
+        if state == "repricing":
+            self.reprices += 1
+        elif state == "filled":
+            self.filled_in = round(time() - self.created, 1)
+        self.state = state
+
+
+    def reduce(self, filled_share: float):
+        self.amount = float(round_cut(self.amount * (1 - filled_share), 2))
+        self.usd_amount = round_cut(float(self.usd_amount) * (1 - filled_share), 2)
+
+
+    def record_fill(self, order: dict):
+        filled_share = get_filled_share(order)
+        self.filled_amount += float(order["filled"].split('/')[0])
+        self.filled_price += float(order["totalPrice"]) * filled_share
+        self.reduce(filled_share)
+        return filled_share
+
+
+    def total_fill(self, order: dict):
+        if not self.filled_amount:
+            return order
+        filled, total = order["filled"].split('/')
+        return {
+            **order,
+            "filled": f"{round(float(filled) + self.filled_amount, 6)}/{round(float(total) + self.filled_amount, 6)}",
+            "totalPrice": str(round(float(order["totalPrice"]) + self.filled_price, 6)),
+        }
+
+
+    def record_drift(self, top_price: float):
+        drift = round(abs(self.price - top_price) * 100, 2)
+        self.book_checks += 1
+        self.drift_sum += drift
+        self.drift_max = max(self.drift_max, drift)
+
+
+    def metrics(self):
+        return {
+            "state": self.state,
+            "reprices": self.reprices,
+            "filled_in": self.filled_in,
+            "drift_avg": round(self.drift_sum / self.book_checks, 2) if self.book_checks else 0,
+            "drift_max": self.drift_max,
+        }
+
+
+class OrderWatcher:
+
+    def __init__(self, browser: Browser):
+        self.browser = browser
+        self.orders = {}
+        self.task = None
+        self.wakeup = asyncio.Event()
+        self.requests = 0
+
+
+    def watch(self, trans_no: str, topic_id: int, is_parent: bool):
+        self.orders[trans_no] = {
+            "future": asyncio.get_running_loop().create_future(),
+            "topic_id": topic_id,
+            "is_parent": is_parent,
+            "placed": time(),
+            "order": None,
+        }
+        self.wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+
+    async def wait(self, trans_no: str, timeout: float = None):
+        future = self.orders[trans_no]["future"]
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                return None
+        finally:
+            if future.done():
+                self.orders.pop(trans_no, None)
+        return future.result()
+
+
+    def forget(self, trans_no: str):
+        watched = self.orders.pop(trans_no, None)
+        if watched is None:
+            return
+        if not watched["future"].done():
+            watched["future"].cancel()
+        elif not watched["future"].cancelled():
+            watched["future"].exception()
+        self.wakeup.set()
+
+
+    def last_seen(self, trans_no: str):
+        watched = self.orders.get(trans_no)
+        return watched and watched["order"]
+
+
+    def _pending(self):
+        return [watched for watched in self.orders.values() if not watched["future"].done()]
+
+
+    async def _run(self):
+        while self._pending():
+            self.wakeup.clear()
+            try:
+                await self.poll()
+            except Exception as err:
+                for watched in self._pending():
+                    watched["future"].set_exception(err)
+                break
+
+            pending = self._pending()
+            if not pending:
+                break
+            # just placed orders usually fill in seconds, resting limits are checked rarely
+            if time() - max(watched["placed"] for watched in pending) < ORDER_WATCHER["fast_seconds"]:
+                interval = ORDER_WATCHER["fast"]
+            else:
+                interval = ORDER_WATCHER["slow"]
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def poll(self):
+        self.requests += 1
+        orders = await self.browser.get_orders(order_type="market")
+        orders_by_no = {order["transNo"]: order for order in orders}
+
+        for trans_no, watched in list(self.orders.items()):
+            if watched["future"].done():
+                continue
+            order = orders_by_no.get(trans_no)
+            if order is None and len(orders) == 100: # page is full, the order may be cut off
+                self.requests += 1
+                order = await self.browser.get_orders(
+                    topic_id=watched["topic_id"],
+                    trans_no=trans_no,
+                    is_parent=watched["is_parent"],
+                    order_type="market",
+                )
+            if order:
+                watched["order"] = order
+            if order and is_filled(order) and not watched["future"].done():
+                watched["future"].set_result(order)
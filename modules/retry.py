@@ -3,9 +3,6 @@ from loguru import logger
 
 from settings import RETRY
 
-from requests.exceptions import JSONDecodeError as json_error1
-from json.decoder import JSONDecodeError as json_error2
-
 
 class CustomError(Exception): pass
 
@@ -23,19 +20,6 @@ class TransactionError(Exception):
         self.encoded_tx = encoded_tx
 
 
-def have_json(func):
-    async def wrapper(*args, **kwargs):
-        response = await func(*args, **kwargs)
-        try:
-            await response.json()
-        except (json_error1, json_error2):
-            error_msg = (await response.text())[:350].replace("\n", " ")
-            raise Exception(f'bad json response: {error_msg}')
-
-        return response
-    return wrapper
-
-
 def retry(
         source: str,
         module_str: str = None,
@@ -0,0 +1,144 @@
+from typing import Callable
+from random import choice
+from loguru import logger
+from time import time
+import asyncio
+import heapq
+
+from settings import BID_SETTINGS, MARKET_SCANNER
+
+
+class MarketScanner:
+
+    def __init__(self):
+        self.browser = None
+        self.new_browser = None
+        self.failures = 0
+        self.task = None
+        self.ready = asyncio.Event()
+        self.rescan = asyncio.Event()
+        self.scanned = asyncio.Event()
+
+        self.index = []
+        self.dropped = set()
+        self.updated = 0
+
+
+    def start(self, new_browser: Callable):
+        self.new_browser = new_browser
+        if self.task is None or self.task.done():
+            if self.browser is None:
+                self.browser = new_browser()
+            self.ready = asyncio.Event()
+            self.rescan = asyncio.Event()
+            self.scanned = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.index = []
+        self.scanned.set()
+        if self.browser:
+            await self.browser.close_sessions()
+            self.browser = None
+
+
+    async def _run(self):
+        while True:
+            self.rescan.clear()
+            try:
+                await self.scan()
+                self.failures = 0
+            except Exception as err:
+                logger.warning(f'[-] Market Scanner | Failed to scan events: {err}')
+                self.failures += 1
+                if self.failures >= MARKET_SCANNER["failures"]:
+                    await self.replace_browser()
+            finally:
+                self.ready.set()
+                scanned, self.scanned = self.scanned, asyncio.Event()
+                scanned.set()
+
+            # nothing to hand out, try again soon instead of waiting for the full interval
+            delay = MARKET_SCANNER["seconds"] if self.index else MARKET_SCANNER["retry"]
+            try:
+                await asyncio.wait_for(self.rescan.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def replace_browser(self):
+        # proxy of the scanner may be dead or rate limited, continue with a new one
+        logger.warning(f'[-] Market Scanner | {self.failures} scans failed in a row, recreating browser with another proxy')
+        self.failures = 0
+        old_browser, self.browser = self.browser, self.new_browser()
+        await old_browser.close_sessions()
+
+
+    async def scan(self):
+        events = [
+            event for event in await self.browser.get_topics()
+            if min(event["prices"]) * 100 >= BID_SETTINGS["PARSE"]["min_event_percent"]
+        ]
+        semaphore = asyncio.Semaphore(MARKET_SCANNER["threads"])
+
+        async def check_event(event: dict):
+            async with semaphore:
+                book = await self.browser.get_event_book(
+                    question_id=event["raw_event"]["questionId"],
+                    symbol=event["raw_event"]["yesPos"],
+                    event_choice_index=0,
+                )
+            if not book["asks"] or not book["bids"]:
+                return None
+            spread = round((book["asks"][0] - book["bids"][0]) * 100, 3)
+            if spread <= BID_SETTINGS["PARSE"]["max_spread"]:
+                event["prices"] = [book["asks"][0], round(1 - book["bids"][0], 3)]
+                return spread, event
+
+        checked = await asyncio.gather(*[check_event(event) for event in events], return_exceptions=True)
+        if checked and all(isinstance(result, Exception) for result in checked):
+            raise checked[0]
+
+        index = []
+        for number, result in enumerate(checked):
+            if result and not isinstance(result, Exception):
+                spread, event = result
+                # tightest spread first, then the most balanced outcome
+                heapq.heappush(index, (spread, -min(event["prices"]), number, event))
+
+        self.index = index
+        self.dropped = set()
+        self.updated = time()
+        logger.debug(f'Market Scanner | {len(index)} of {len(events)} events are eligible')
+
+
+    def get_candidates(self):
+        return [
+            candidate for candidate in heapq.nsmallest(MARKET_SCANNER["top"] + len(self.dropped), self.index)
+            if candidate[3]["raw_event"]["questionId"] not in self.dropped
+        ][:MARKET_SCANNER["top"]]
+
+
+    async def get_event(self):
+        await self.ready.wait()
+        candidates = self.get_candidates()
+        if not candidates:
+            # index is empty or fully dropped, wait for a fresh scan instead of failing the account
+            scanned = self.scanned
+            self.rescan.set()
+            await scanned.wait()
+            candidates = self.get_candidates()
+            if not candidates:
+                return None
+
+        event = choice(candidates)[3]
+        return {**event, "prices": event["prices"].copy()}
+
+
+    def drop(self, event: dict):
+        self.dropped.add(event["raw_event"]["questionId"])
@@ -0,0 +1,296 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from loguru import logger
+import asyncio
+
+from .storage import count_entries
+from modules.utils import codec
+
+
+class StateStore:
+    def __init__(
+            self,
+            storage,
+            wal_name: str,
+            checkpoint_seconds: int,
+            checkpoint_changes: int,
+            lock: asyncio.Lock,
+            executor: ThreadPoolExecutor,
+    ):
+        self.storage = storage
+        self.wal_name = wal_name
+        self.lock = lock
+        self.executor = executor
+        self.checkpoint_seconds = checkpoint_seconds
+        self.checkpoint_changes = checkpoint_changes
+
+        self.modules_db = None
+        self.stats = None
+        self.failed_keys = set()
+        self.dirty = set()
+        self.dirty_stats = set()
+        self.checkpoint_event = None
+        self.checkpointer = None
+
+        self.wal = None
+        self.recover()
+        self.wal = open(self.wal_name, 'ab')
+
+
+    def recover(self):
+        if not path.isfile(self.wal_name) or path.getsize(self.wal_name) == 0:
+            return
+
+        modules_db = self.load()
+        stats = self.load_stats()
+        replayed = 0
+        with open(self.wal_name, 'rb') as f:
+            for line in f:
+                try:
+                    record = codec.loads(line)
+                except ValueError: # last line cut off by crash, never applied
+                    break
+
+                if "stat" in record:
+                    if record["value"] is None:
+                        stats.pop(record["stat"], None)
+                    else:
+                        stats[record["stat"]] = record["value"]
+                    self.dirty_stats.add(record["stat"])
+
+                else:
+                    if record["entry"] is None:
+                        modules_db.pop(record["key"], None)
+                    else:
+                        modules_db[record["key"]] = record["entry"]
+                    self._mark_dirty(record["key"])
+                replayed += 1
+
+        logger.warning(f'[•] Database | Recovered {replayed} unsaved changes')
+        self.checkpoint()
+
+
+    def load(self):
+        if self.modules_db is None:
+            self.modules_db = self.storage.load()
+            self.failed_keys = {
+                key for key, entry in self.modules_db.items()
+                if any(module["status"] != "to_run" for module in entry["modules"])
+            }
+        return self.modules_db
+
+
+    def load_stats(self):
+        if self.stats is None:
+            self.stats = self.storage.load_stats()
+        return self.stats
+
+
+    def get_counts(self):
+        if self.modules_db is None:
+            return self.storage.get_counts()
+        return count_entries(self.modules_db)
+
+
+    def first(self):
+        if self.modules_db is None:
+            return self.storage.first()
+        return next(iter(self.modules_db.items()), None)
+
+
+    def get(self, key: str):
+        return self.load().get(key)
+
+
+    def refresh(self, key: str, entry: dict | None, stats: dict):
+        modules_db = self.load()
+        if entry is None:
+            modules_db.pop(key, None)
+        else:
+            modules_db[key] = entry
+        self._update_failed(key)
+
+        all_stats = self.load_stats()
+        for address, value in stats.items():
+            if value is None:
+                all_stats.pop(address, None)
+            else:
+                all_stats[address] = value
+
+
+    def drop_cache(self):
+        self.checkpoint()
+        self.modules_db = None
+        self.stats = None
+        self.failed_keys = set()
+
+
+    def _write_wal(self, key: str, entry: dict | None):
+        self.wal.write(codec.encode({"key": key, "entry": entry}) + b'\n')
+        self.wal.flush()
+
+
+    def _write_stat_wal(self, address: str, value: list | None):
+        self.wal.write(codec.encode({"stat": address, "value": value}) + b'\n')
+        self.wal.flush()
+
+
+    def _update_failed(self, key: str):
+        entry = self.modules_db.get(key)
+        if entry and any(module["status"] != "to_run" for module in entry["modules"]):
+            self.failed_keys.add(key)
+        else:
+            self.failed_keys.discard(key)
+
+
+    def _mark_dirty(self, key: str):
+        self._update_failed(key)
+        self.dirty.add(key)
+        if len(self.dirty) >= self.checkpoint_changes and self.checkpoint_event:
+            self.checkpoint_event.set()
+
+
+    async def put(self, key: str, entry: dict):
+        self.load()[key] = entry
+        self._mark_dirty(key)
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._write_wal, key, entry)
+
+
+    async def delete(self, key: str):
+        self.load().pop(key, None)
+        self._mark_dirty(key)
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._write_wal, key, None)
+
+
+    def update_many(self, changes: dict):
+        modules_db = self.load()
+        for key, entry in changes.items():
+            if entry is None:
+                modules_db.pop(key, None)
+            else:
+                modules_db[key] = entry
+            self._write_wal(key, entry)
+            self._mark_dirty(key)
+        self.checkpoint()
+
+
+    def get_stat(self, address: str):
+        return self.load_stats().get(address)
+
+
+    async def set_stat(self, address: str, value: list | None):
+        stats = self.load_stats()
+        if value is None:
+            stats.pop(address, None)
+        else:
+            stats[address] = value
+        self.dirty_stats.add(address)
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._write_stat_wal, address, value)
+
+
+    def update_stats(self, changes: dict):
+        stats = self.load_stats()
+        for address, value in changes.items():
+            if value is None:
+                stats.pop(address, None)
+            else:
+                stats[address] = value
+            self._write_stat_wal(address, value)
+            self.dirty_stats.add(address)
+        self.checkpoint()
+
+
+    def replace_stats(self, stats: dict):
+        self.checkpoint()
+        self.storage.replace_stats(stats)
+        self.stats = stats
+
+
+    def replace_all(self, modules_db: dict):
+        self.checkpoint()
+        self.storage.replace_all(modules_db)
+        self.modules_db = modules_db
+        self.failed_keys = set()
+        self.dirty.clear()
+        self.truncate_wal()
+
+
+    def reset_statuses(self, statuses: list, new_status: str = "to_run"):
+        modules_db = self.load()
+        for key in list(self.failed_keys):
+            entry = modules_db[key]
+            for module in entry["modules"]:
+                if module["status"] in statuses: module["status"] = new_status
+            self._write_wal(key, entry)
+            self._mark_dirty(key)
+
+
+    def truncate_wal(self):
+        if self.wal:
+            self.wal.truncate(0)
+        else:
+            with open(self.wal_name, 'wb'): pass
+
+
+    def take_snapshot(self):
+        if not self.dirty and not self.dirty_stats:
+            return None
+
+        # stats change outside of `lock`, so they are copied here, on the event loop thread
+        snapshot = {
+            "changes": {key: self.modules_db.get(key) for key in self.dirty},
+            "stats": dict(self.stats) if self.dirty_stats else None,
+            "stats_changes": {address: self.stats.get(address) for address in self.dirty_stats},
+        }
+        self.dirty.clear()
+        self.dirty_stats.clear()
+        return snapshot
+
+
+    def write_snapshot(self, snapshot: dict):
+        self.storage.checkpoint(modules_db=self.modules_db, **snapshot)
+        self.truncate_wal()
+
+
+    def checkpoint(self):
+        snapshot = self.take_snapshot()
+        if snapshot:
+            self.write_snapshot(snapshot)
+
+
+    async def checkpoint_async(self):
+        async with self.lock:
+            snapshot = self.take_snapshot()
+            if snapshot:
+                await asyncio.get_running_loop().run_in_executor(self.executor, self.write_snapshot, snapshot)
+
+
+    async def run_checkpointer(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.checkpoint_event.wait(), timeout=self.checkpoint_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self.checkpoint_event.clear()
+            await self.checkpoint_async()
+
+
+    def start_checkpointer(self):
+        self.checkpoint_event = asyncio.Event()
+        self.checkpointer = asyncio.create_task(self.run_checkpointer())
+
+
+    async def stop_checkpointer(self):
+        if self.checkpointer:
+            self.checkpointer.cancel()
+            try: await self.checkpointer
+            except asyncio.CancelledError: pass
+            self.checkpointer = None
+            self.checkpoint_event = None
+        await self.checkpoint_async()
+
+
+    def close(self):
+        self.checkpoint()
+        self.wal.close()
+
@@ -0,0 +1,587 @@
+from os import path, replace, fsync
+from time import time
+import sqlite3
+
+from modules.utils import codec
+
+
+def atomic_write(file_name: str, data: str | list):
+    with open(file_name + '.tmp', 'w', encoding="utf-8") as f:
+        if type(data) == str:
+            f.write(data)
+        else:
+            f.writelines(data)
+        f.flush()
+        fsync(f.fileno())
+    replace(file_name + '.tmp', file_name)
+
+
+def count_entries(modules_db: dict):
+    return {
+        "is_groups": any(entry.get("group_number") is not None for entry in modules_db.values()),
+        "entries": len(modules_db),
+        "modules": sum(len(entry["modules"]) for entry in modules_db.values()),
+    }
+
+
+class JsonStorage:
+    CACHE_COMPACT_AFTER = 1000
+
+    def __init__(self, modules_db_name: str, stats_db_name: str, cache_db_name: str):
+        self.modules_db_name = modules_db_name
+        self.stats_db_name = stats_db_name
+        self.cache_db_name = cache_db_name
+        self.meta_name = modules_db_name.removesuffix('.json') + '.meta.json'
+        # account cache changes are appended here and merged into `cache_db_name` from time to time
+        self.cache_journal_name = cache_db_name.removesuffix('.json') + '.journal'
+        self.account_cache = None
+        self.cache_journal = None
+        self.cache_journal_lines = 0
+
+        for db_params in [
+            {"name": self.modules_db_name, "value": "{}"},
+            {"name": self.stats_db_name, "value": "{}"},
+            {"name": self.cache_db_name, "value": "{}"},
+        ]:
+            if not path.isfile(db_params["name"]):
+                with open(db_params["name"], 'w') as f: f.write(db_params["value"])
+
+
+    def load(self):
+        with open(self.modules_db_name, 'rb') as f: modules_db = codec.loads(f.read())
+        return modules_db or {}
+
+
+    def replace_all(self, modules_db: dict):
+        # dump entries one by one so a checkpoint running in executor does not hold the GIL for the whole file
+        atomic_write(self.modules_db_name, [
+            "{",
+            *(
+                ("," if index else "") + codec.dumps(key) + ":" + codec.dumps(entry)
+                for index, (key, entry) in enumerate(modules_db.items())
+            ),
+            "}",
+        ])
+        self.write_meta(count_entries(modules_db))
+
+
+    def write_meta(self, counts: dict):
+        atomic_write(self.meta_name, codec.dumps({**counts, "size": path.getsize(self.modules_db_name)}))
+
+
+    def get_counts(self):
+        if path.isfile(self.meta_name):
+            with open(self.meta_name, 'rb') as f: meta = codec.loads(f.read())
+            if meta.get("size") == path.getsize(self.modules_db_name):
+                del meta["size"]
+                return meta
+
+        counts = count_entries(self.load())
+        self.write_meta(counts)
+        return counts
+
+
+    def load_stats(self):
+        with open(self.stats_db_name, 'rb') as f: stats_db = codec.loads(f.read())
+        return stats_db.get("modules_done", {})
+
+
+    def replace_stats(self, stats: dict):
+        atomic_write(self.stats_db_name, codec.dumps({"modules_done": stats}))
+
+
+    def checkpoint(self, modules_db: dict, changes: dict, stats: dict, stats_changes: dict):
+        if changes:
+            self.replace_all(modules_db)
+        if stats_changes:
+            self.replace_stats(stats)
+
+
+    def first(self):
+        modules_db = self.load()
+        return next(iter(modules_db.items()), None)
+
+
+    def get(self, key: str):
+        return self.load().get(key)
+
+
+    def put(self, key: str, entry: dict):
+        modules_db = self.load()
+        modules_db[key] = entry
+        self.replace_all(modules_db)
+
+
+    def delete(self, key: str):
+        modules_db = self.load()
+        if key in modules_db:
+            del modules_db[key]
+            self.replace_all(modules_db)
+
+
+    def load_account_cache(self):
+        if self.account_cache is None:
+            with open(self.cache_db_name, 'rb') as f: self.account_cache = codec.loads(f.read())
+            if path.isfile(self.cache_journal_name):
+                with open(self.cache_journal_name, 'rb') as f:
+                    for line in f:
+                        try:
+                            record = codec.loads(line)
+                        except ValueError: # last line cut off by crash
+                            break
+                        self._merge_account_cache(record["address"], record["changes"])
+                        self.cache_journal_lines += 1
+            self.cache_journal = open(self.cache_journal_name, 'ab')
+        return self.account_cache
+
+
+    def _merge_account_cache(self, address: str, changes: dict):
+        account_cache = {**self.account_cache.get(address, {}), **changes}
+        self.account_cache[address] = {key: value for key, value in account_cache.items() if value is not None}
+
+
+    def get_account_cache(self, address: str):
+        return self.load_account_cache().get(address, {})
+
+
+    def update_account_cache(self, address: str, changes: dict):
+        self.load_account_cache()
+        self._merge_account_cache(address, changes)
+        self.cache_journal.write(codec.encode({"address": address, "changes": changes}) + b'\n')
+        self.cache_journal.flush()
+        self.cache_journal_lines += 1
+        if self.cache_journal_lines > self.CACHE_COMPACT_AFTER:
+            self.compact_account_cache()
+
+
+    def compact_account_cache(self):
+        atomic_write(self.cache_db_name, codec.dumps(self.account_cache))
+        self.cache_journal.truncate(0)
+        self.cache_journal_lines = 0
+
+
+class SqliteStorage:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            encoded_privatekey  TEXT PRIMARY KEY,
+            address             TEXT NOT NULL,
+            proxy               TEXT,
+            label               TEXT
+        );
+        CREATE TABLE IF NOT EXISTS groups (
+            group_index         TEXT PRIMARY KEY,
+            group_number        INTEGER NOT NULL,
+            wallets_data        TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS modules (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner               TEXT NOT NULL,
+            module_name         TEXT NOT NULL,
+            status              TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS modules_done (
+            address             TEXT PRIMARY KEY,
+            done                INTEGER NOT NULL,
+            total               INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            address             TEXT PRIMARY KEY,
+            worker              TEXT NOT NULL,
+            expires             REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS account_cache (
+            address             TEXT PRIMARY KEY,
+            data                TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS modules_owner ON modules (owner, id);
+        CREATE INDEX IF NOT EXISTS modules_status ON modules (status);
+    """
+
+    def __init__(self, db_name: str, shared: bool = False):
+        self.db_name = db_name
+        self.is_new = not path.isfile(self.db_name)
+
+        self.conn = sqlite3.connect(self.db_name, timeout=30, check_same_thread=False)
+        if shared:
+            # WAL index lives in shared memory of one machine, hosts on a network share need rollback journal
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+            self.conn.execute("PRAGMA synchronous=FULL")
+        else:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+
+    def close(self):
+        self.conn.close()
+
+
+    def is_groups(self):
+        return self.conn.execute("SELECT 1 FROM groups LIMIT 1").fetchone() is not None
+
+
+    def get_counts(self):
+        is_groups = self.is_groups()
+        return {
+            "is_groups": is_groups,
+            "entries": self.conn.execute(f"SELECT COUNT(*) FROM {'groups' if is_groups else 'accounts'}").fetchone()[0],
+            "modules": self.conn.execute("SELECT COUNT(*) FROM modules").fetchone()[0],
+        }
+
+
+    def _get_modules(self, owner: str):
+        return [
+            {"module_name": module_name, "status": status}
+            for module_name, status in self.conn.execute(
+                "SELECT module_name, status FROM modules WHERE owner = ? ORDER BY id", (owner,)
+            )
+        ]
+
+
+    def _entry_from_row(self, row: tuple, is_groups: bool):
+        if is_groups:
+            group_index, group_number, wallets_data = row
+            return group_index, {
+                "group_number": group_number,
+                "modules": self._get_modules(group_index),
+                "wallets_data": codec.loads(wallets_data),
+            }
+        encoded_privatekey, address, proxy, label = row
+        return encoded_privatekey, {
+            "address": address,
+            "modules": self._get_modules(encoded_privatekey),
+            "proxy": proxy,
+            "label": label,
+        }
+
+
+    def load(self):
+        modules_by_owner = {}
+        for owner, module_name, status in self.conn.execute(
+            "SELECT owner, module_name, status FROM modules ORDER BY id"
+        ):
+            modules_by_owner.setdefault(owner, []).append({"module_name": module_name, "status": status})
+
+        modules_db = {}
+        for account_row in self.conn.execute("SELECT encoded_privatekey, address, proxy, label FROM accounts ORDER BY rowid"):
+            modules_db[account_row[0]] = {
+                "address": account_row[1],
+                "modules": modules_by_owner.get(account_row[0], []),
+                "proxy": account_row[2],
+                "label": account_row[3],
+            }
+        for group_row in self.conn.execute("SELECT group_index, group_number, wallets_data FROM groups ORDER BY rowid"):
+            modules_db[group_row[0]] = {
+                "group_number": group_row[1],
+                "modules": modules_by_owner.get(group_row[0], []),
+                "wallets_data": codec.loads(group_row[2]),
+            }
+        return modules_db
+
+
+    def replace_all(self, modules_db: dict):
+        with self.conn:
+            self.conn.execute("DELETE FROM modules")
+            self.conn.execute("DELETE FROM accounts")
+            self.conn.execute("DELETE FROM groups")
+            self.conn.executemany(
+                "INSERT INTO accounts (encoded_privatekey, address, proxy, label) VALUES (?, ?, ?, ?)",
+                (
+                    (key, entry["address"], entry.get("proxy"), entry.get("label"))
+                    for key, entry in modules_db.items() if entry.get("group_number") is None
+                ),
+            )
+            self.conn.executemany(
+                "INSERT INTO groups (group_index, group_number, wallets_data) VALUES (?, ?, ?)",
+                (
+                    (key, entry["group_number"], codec.dumps(entry["wallets_data"]))
+                    for key, entry in modules_db.items() if entry.get("group_number") is not None
+                ),
+            )
+            self.conn.executemany(
+                "INSERT INTO modules (owner, module_name, status) VALUES (?, ?, ?)",
+                (
+                    (key, module["module_name"], module["status"])
+                    for key, entry in modules_db.items() for module in entry["modules"]
+                ),
+            )
+
+
+    def first(self):
+        is_groups = self.is_groups()
+        if is_groups:
+            row = self.conn.execute("SELECT group_index, group_number, wallets_data FROM groups ORDER BY rowid LIMIT 1").fetchone()
+        else:
+            row = self.conn.execute("SELECT encoded_privatekey, address, proxy, label FROM accounts ORDER BY rowid LIMIT 1").fetchone()
+        if row is None:
+            return None
+        return self._entry_from_row(row, is_groups)
+
+
+    def get(self, key: str):
+        row = self.conn.execute(
+            "SELECT encoded_privatekey, address, proxy, label FROM accounts WHERE encoded_privatekey = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            return self._entry_from_row(row, False)[1]
+
+        row = self.conn.execute(
+            "SELECT group_index, group_number, wallets_data FROM groups WHERE group_index = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            return self._entry_from_row(row, True)[1]
+
+
+    def _put(self, key: str, entry: dict):
+        if entry.get("group_number") is not None:
+            self.conn.execute(
+                "INSERT INTO groups (group_index, group_number, wallets_data) VALUES (?, ?, ?) "
+                "ON CONFLICT (group_index) DO UPDATE SET group_number = excluded.group_number, wallets_data = excluded.wallets_data",
+                (key, entry["group_number"], codec.dumps(entry["wallets_data"])),
+            )
+        else:
+            self.conn.execute(
+                "INSERT INTO accounts (encoded_privatekey, address, proxy, label) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (encoded_privatekey) DO UPDATE SET address = excluded.address, proxy = excluded.proxy, label = excluded.label",
+                (key, entry["address"], entry.get("proxy"), entry.get("label")),
+            )
+
+        self.conn.execute("DELETE FROM modules WHERE owner = ?", (key,))
+        self.conn.executemany(
+            "INSERT INTO modules (owner, module_name, status) VALUES (?, ?, ?)",
+            [(key, module["module_name"], module["status"]) for module in entry["modules"]],
+        )
+
+
+    def put(self, key: str, entry: dict):
+        with self.conn:
+            self._put(key, entry)
+
+
+    def _delete(self, key: str):
+        self.conn.execute("DELETE FROM modules WHERE owner = ?", (key,))
+        self.conn.execute("DELETE FROM accounts WHERE encoded_privatekey = ?", (key,))
+        self.conn.execute("DELETE FROM groups WHERE group_index = ?", (key,))
+
+
+    def delete(self, key: str):
+        with self.conn:
+            self._delete(key)
+
+
+    def load_stats(self):
+        return {
+            address: [done, total]
+            for address, done, total in self.conn.execute("SELECT address, done, total FROM modules_done")
+        }
+
+
+    def _put_stats(self, stats_changes: dict):
+        self.conn.executemany(
+            "DELETE FROM modules_done WHERE address = ?",
+            [(address,) for address, value in stats_changes.items() if value is None],
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO modules_done (address, done, total) VALUES (?, ?, ?)",
+            [(address, *value) for address, value in stats_changes.items() if value is not None],
+        )
+
+
+    def replace_stats(self, stats: dict):
+        with self.conn:
+            self.conn.execute("DELETE FROM modules_done")
+            self._put_stats(stats)
+
+
+    def checkpoint(self, modules_db: dict, changes: dict, stats: dict, stats_changes: dict):
+        with self.conn:
+            for key, entry in changes.items():
+                if entry is None:
+                    self._delete(key)
+                else:
+                    self._put(key, entry)
+            self._put_stats(stats_changes)
+
+
+    def get_stats(self, addresses: list):
+        stats = dict.fromkeys(addresses)
+        for address in addresses:
+            row = self.conn.execute("SELECT done, total FROM modules_done WHERE address = ?", (address,)).fetchone()
+            if row is not None:
+                stats[address] = list(row)
+        return stats
+
+
+    def reset_statuses(self, statuses: list, new_status: str = "to_run"):
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE modules SET status = ? WHERE status IN ({', '.join('?' * len(statuses))})",
+                (new_status, *statuses),
+            )
+
+
+    def _get_addresses(self, key: str):
+        row = self.conn.execute("SELECT address FROM accounts WHERE encoded_privatekey = ?", (key,)).fetchone()
+        if row is not None:
+            return [row[0]]
+        row = self.conn.execute("SELECT wallets_data FROM groups WHERE group_index = ?", (key,)).fetchone()
+        if row is not None:
+            return [wallet_data["address"] for wallet_data in codec.loads(row[0])]
+        return []
+
+
+    def _pending_query(self, unique_wallets: bool, shuffled: bool = False):
+        query = "SELECT owner, module_name FROM modules WHERE status = 'to_run'"
+        if unique_wallets:
+            query += " AND id IN (SELECT MAX(id) FROM modules GROUP BY owner)"
+        return query + (" ORDER BY random()" if shuffled else " ORDER BY id")
+
+
+    def has_pending(self, unique_wallets: bool):
+        return self.conn.execute(self._pending_query(unique_wallets) + " LIMIT 1").fetchone() is not None
+
+
+    def claim(self, worker: str, lease_seconds: int, unique_wallets: bool, shuffled: bool):
+        now = time()
+        with self.conn:
+            # IMMEDIATE takes the write lock up front, so two workers never pick the same module
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("DELETE FROM leases WHERE expires < ?", (now,))
+            leased = {address for address, in self.conn.execute("SELECT address FROM leases")}
+
+            checked_owners = set()
+            for owner, module_name in self.conn.execute(self._pending_query(unique_wallets, shuffled)):
+                if owner in checked_owners: continue
+                checked_owners.add(owner)
+
+                addresses = self._get_addresses(owner)
+                if leased.isdisjoint(addresses):
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO leases (address, worker, expires) VALUES (?, ?, ?)",
+                        [(address, worker, now + lease_seconds) for address in addresses],
+                    )
+                    return owner, module_name
+
+
+    def extend_lease(self, worker: str, addresses: list, lease_seconds: int):
+        with self.conn:
+            extended = self.conn.executemany(
+                "UPDATE leases SET expires = ? WHERE address = ? AND worker = ?",
+                [(time() + lease_seconds, address, worker) for address in addresses],
+            ).rowcount
+        return extended == len(addresses)
+
+
+    def release(self, worker: str, addresses: list):
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM leases WHERE address = ? AND worker = ?",
+                [(address, worker) for address in addresses],
+            )
+
+
+    def get_account_cache(self, address: str):
+        row = self.conn.execute("SELECT data FROM account_cache WHERE address = ?", (address,)).fetchone()
+        return codec.loads(row[0]) if row else {}
+
+
+    def update_account_cache(self, address: str, changes: dict):
+        with self.conn:
+            account_cache = {**self.get_account_cache(address), **changes}
+            self.conn.execute(
+                "INSERT OR REPLACE INTO account_cache (address, data) VALUES (?, ?)",
+                (address, codec.dumps({key: value for key, value in account_cache.items() if value is not None})),
+            )
+
+
+class ReportJournal:
+    COMPACT_AFTER = 1000
+
+    def __init__(self, journal_name: str):
+        self.journal_name = journal_name
+        self.index = {}
+        self.dead_lines = 0
+
+        self.replay()
+        if self.dead_lines > self.COMPACT_AFTER:
+            self.compact()
+        self.journal = open(self.journal_name, 'ab')
+
+
+    def replay(self):
+        self.index = {}
+        self.dead_lines = 0
+        if not path.isfile(self.journal_name):
+            return
+
+        offset = 0
+        with open(self.journal_name, 'rb') as f:
+            for line in f:
+                line_offset, offset = offset, offset + len(line)
+                try:
+                    record = codec.loads(line)
+                except ValueError: # line cut off by crash
+                    self.dead_lines += 1
+                    continue
+
+                if record.get("clear"):
+                    self.dead_lines += len(self.index.pop(record["key"], [])) + 1
+                else:
+                    self.index.setdefault(record["key"], []).append(line_offset)
+
+
+    def _write(self, record: dict):
+        offset = self.journal.tell()
+        self.journal.write(codec.encode(record) + b'\n')
+        self.journal.flush()
+        return offset
+
+
+    def append(self, key: str, text: str, success: bool = None):
+        offset = self._write({"key": key, "text": text, "success": success})
+        self.index.setdefault(key, []).append(offset)
+
+
+    def get(self, key: str):
+        offsets = self.index.get(key)
+        if not offsets:
+            return []
+
+        records = []
+        with open(self.journal_name, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                records.append(codec.loads(f.readline()))
+        return records
+
+
+    def remove(self, key: str):
+        offsets = self.index.pop(key, None)
+        if offsets is None:
+            return
+
+        self._write({"key": key, "clear": True})
+        self.dead_lines += len(offsets) + 1
+        if self.dead_lines > self.COMPACT_AFTER and self.dead_lines > sum(len(v) for v in self.index.values()):
+            self.compact()
+
+
+    def compact(self):
+        live_records = [record for key in self.index for record in self.get(key)]
+
+        if getattr(self, "journal", None):
+            self.journal.close()
+        with open(self.journal_name + '.tmp', 'wb') as f:
+            for record in live_records:
+                f.write(codec.encode(record) + b'\n')
+        replace(self.journal_name + '.tmp', self.journal_name)
+
+        self.replay()
+        self.journal = open(self.journal_name, 'ab')
+
+
+    def clear(self):
+        self.journal.close()
+        self.journal = open(self.journal_name, 'wb')
+        self.index = {}
+        self.dead_lines = 0
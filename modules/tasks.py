@@ -0,0 +1,182 @@
+from dataclasses import dataclass, field
+from collections import deque
+from random import shuffle
+from loguru import logger
+from array import array
+import asyncio
+
+
+@dataclass(slots=True)
+class Account:
+    encoded_privatekey: str
+    address: str
+    proxy: str | None
+    label: str
+
+
+@dataclass(slots=True)
+class ModuleTask:
+    account: Account
+    module_name: str
+    status: bool | str | None = "to_run"
+
+    @property
+    def encoded_privatekey(self): return self.account.encoded_privatekey
+
+    @property
+    def address(self): return self.account.address
+
+    @property
+    def label(self): return self.account.label
+
+    @property
+    def addresses(self): return [self.account.address]
+
+
+@dataclass(slots=True)
+class GroupTask:
+    group_index: str
+    group_number: int
+    module_name: str
+    wallets: list[Account] = field(default_factory=list)
+    status: bool | str | None = "to_run"
+
+    @property
+    def addresses(self): return [account.address for account in self.wallets]
+
+
+class ModulesQueue:
+    NAMES_LIMIT = 256
+
+    def __init__(self):
+        self.accounts: list[Account] = []
+        self.module_names: list[str] = []
+        # one int per module: account index * NAMES_LIMIT + module name index
+        self.tasks = array('Q')
+
+
+    def add_account(self, account: Account, module_names: list[str]):
+        account_index = len(self.accounts)
+        self.accounts.append(account)
+        for module_name in module_names:
+            if module_name not in self.module_names:
+                self.module_names.append(module_name)
+                if len(self.module_names) > self.NAMES_LIMIT:
+                    raise ValueError(f'Too many different module names')
+            self.tasks.append(account_index * self.NAMES_LIMIT + self.module_names.index(module_name))
+
+
+    def shuffle(self):
+        shuffle(self.tasks)
+
+
+    def _make_task(self, packed_task: int):
+        account_index, name_index = divmod(packed_task, self.NAMES_LIMIT)
+        return ModuleTask(account=self.accounts[account_index], module_name=self.module_names[name_index])
+
+
+    def __len__(self):
+        return len(self.tasks)
+
+
+    def __iter__(self):
+        for packed_task in self.tasks:
+            yield self._make_task(packed_task)
+
+
+class TaskScheduler:
+    def __init__(self, tasks):
+        self.tasks = iter(tasks)
+        # tasks skipped because their address was busy, in original order
+        self.deferred = deque()
+        self.busy_addresses = set()
+        self.released = asyncio.Event()
+
+
+    def _take_free_task(self):
+        for index, task in enumerate(self.deferred):
+            if self.busy_addresses.isdisjoint(task.addresses):
+                del self.deferred[index]
+                return task
+
+        for task in self.tasks:
+            if self.busy_addresses.isdisjoint(task.addresses):
+                return task
+            self.deferred.append(task)
+
+
+    async def acquire(self):
+        while True:
+            task = self._take_free_task()
+            if task is not None:
+                self.busy_addresses.update(task.addresses)
+                return task
+            elif not self.deferred:
+                return None
+
+            self.released.clear()
+            await self.released.wait()
+
+
+    def release(self, task):
+        self.busy_addresses.difference_update(task.addresses)
+        self.released.set()
+
+
+    async def _run_worker(self, worker):
+        while (task := await self.acquire()) is not None:
+            try:
+                await worker(task)
+            finally:
+                self.release(task)
+
+
+    async def run(self, worker, workers_amount: int):
+        await asyncio.gather(*[self._run_worker(worker) for _ in range(workers_amount)])
+
+
+class LeaseQueue(TaskScheduler):
+    def __init__(self, db, worker: str, unique_wallets: bool, shuffled: bool, lease_seconds: int):
+        super().__init__(tasks=[])
+        self.db = db
+        self.worker = worker
+        self.unique_wallets = unique_wallets
+        self.shuffled = shuffled
+        self.lease_seconds = lease_seconds
+
+
+    async def acquire(self):
+        while True:
+            task = await self.db.claim_task(self.worker, self.unique_wallets, self.shuffled)
+            if task is not None:
+                return task
+            elif not await self.db.has_pending_tasks(self.unique_wallets):
+                return None
+            # every pending module belongs to an address leased by another worker
+            await asyncio.sleep(5)
+
+
+    async def keep_lease(self, task, running: asyncio.Task):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await self.db.extend_lease(self.worker, task):
+                logger.warning(f'[-] Database | Lost lease for {", ".join(task.addresses)}, stopping module')
+                running.cancel()
+                return
+
+
+    async def _run_worker(self, worker):
+        while (task := await self.acquire()) is not None:
+            running = asyncio.create_task(worker(task))
+            heartbeat = asyncio.create_task(self.keep_lease(task, running))
+            lost_lease = False
+            try:
+                await running
+            except asyncio.CancelledError:
+                if not heartbeat.done(): raise
+                # another worker can claim this task now, its result and lease are not ours anymore
+                lost_lease = True
+            finally:
+                heartbeat.cancel()
+                if not lost_lease:
+                    await self.db.release_task(self.worker, task)
@@ -8,6 +8,9 @@ from .utils import (
     format_password,
     get_response_error_reason,
 )
-from .window_name import WindowName
+from .window_name import WindowName, SharedWindowName
+from .connections import get_connector, close_connectors
+from .cache import AsyncTTLCache
+from . import codec
 from .modes import choose_mode
 from .tg_report import TgReport
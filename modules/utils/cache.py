@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Awaitable, Callable, Hashable
+import asyncio
+
+
+class AsyncTTLCache:
+
+    def __init__(self, ttl: float, max_size: int = 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.loading: dict[Hashable, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def stats(self):
+        requests = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / requests, 3) if requests else 0,
+            "size": len(self.values),
+        }
+
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable]):
+        cached = self.values.get(key)
+        if cached is not None:
+            expires, value = cached
+            if monotonic() < expires:
+                self.hits += 1
+                self.values.move_to_end(key)
+                return value
+            del self.values[key]
+
+        task = self.loading.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # loading runs in its own task, so a cancelled caller does not fail other waiters
+            task = asyncio.ensure_future(loader())
+            task.add_done_callback(lambda done: self._loaded(key, done))
+            self.loading[key] = task
+
+        return await asyncio.shield(task)
+
+
+    def _loaded(self, key: Hashable, task: asyncio.Future):
+        if self.loading.get(key) is task:
+            del self.loading[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.ttl > 0:
+            self.set(key, task.result())
+
+
+    def set(self, key: Hashable, value):
+        self.values[key] = (monotonic() + self.ttl, value)
+        self.values.move_to_end(key)
+        while len(self.values) > self.max_size:
+            self.values.popitem(last=False)
+
+
+    def invalidate(self, key: Hashable = None):
+        if key is None:
+            self.values.clear()
+        else:
+            self.values.pop(key, None)
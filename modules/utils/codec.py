@@ -0,0 +1,49 @@
+import json
+
+try:
+    import msgspec
+except ImportError: # optional
+    msgspec = None
+
+try:
+    import orjson
+except ImportError: # optional, stdlib json is used without msgspec and orjson
+    orjson = None
+
+
+if msgspec:
+    BACKEND = "msgspec"
+    json_encoder = msgspec.json.Encoder()
+    json_decoders = {}
+elif orjson:
+    BACKEND = "orjson"
+else:
+    BACKEND = "json"
+
+
+def loads(data: str | bytes, type=None):
+    if msgspec:
+        if type is not None:
+            if type not in json_decoders:
+                json_decoders[type] = msgspec.json.Decoder(type)
+            try:
+                return json_decoders[type].decode(data)
+            except msgspec.ValidationError: # response shape changed, decode it as is
+                pass
+        return msgspec.json.decode(data)
+
+    elif orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode(data) -> bytes:
+    if msgspec:
+        return json_encoder.encode(data)
+    elif orjson:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+
+def dumps(data) -> str:
+    return encode(data).decode()
@@ -0,0 +1,25 @@
+from aiohttp import TCPConnector
+
+from settings import CONNECTION_POOL
+
+
+connectors: dict[str | None, TCPConnector] = {}
+
+
+def get_connector(proxy: str | None = None):
+    connector = connectors.get(proxy)
+    if connector is None or connector.closed:
+        connector = TCPConnector(
+            limit=CONNECTION_POOL["limit"],
+            limit_per_host=CONNECTION_POOL["limit_per_host"],
+            keepalive_timeout=CONNECTION_POOL["keepalive"],
+            ttl_dns_cache=CONNECTION_POOL["dns_cache"],
+        )
+        connectors[proxy] = connector
+    return connector
+
+
+async def close_connectors():
+    for connector in connectors.values():
+        await connector.close()
+    connectors.clear()
@@ -84,6 +84,9 @@ def choose_mode():
                 Mode(soft_id=-1, type="", text="← Exit", is_numeric=False),
                 Mode(soft_id=101, type="database",  text="Create new single database", is_numeric=False),
                 Mode(soft_id=102, type="database",  text="Create new groups database", is_numeric=False),
+                Mode(soft_id=104, type="database",  text="Sync database with input files", is_numeric=False),
+                Mode(soft_id=105, type="database",  text="Sync database with input files (re-add completed)", is_numeric=False),
+                Mode(soft_id=103, type="database",  text="Export database to JSON", is_numeric=False),
             ]
         )
 
@@ -1,6 +1,8 @@
 from loguru import logger
 from aiohttp import ClientSession
 
+from .connections import get_connector
+from . import codec
 from settings import TG_BOT_TOKEN, TG_USER_ID
 
 
@@ -22,7 +24,7 @@ class TgReport:
             notification_text = notification_text[1900:]
 
         if TG_BOT_TOKEN:
-            async with ClientSession() as session:
+            async with ClientSession(connector=get_connector(), connector_owner=False, json_serialize=codec.dumps) as session:
                 for tg_id in TG_USER_ID:
                     for text in texts:
                         # text = text.replace('+', '%2B')
@@ -36,6 +38,6 @@ class TgReport:
                                     'text': text,
                                 }
                             )
-                            response = await r.json()
+                            response = codec.loads(await r.read())
                             if response.get("ok") != True: raise Exception(str(response))
                         except Exception as err: logger.error(f'[-] TG | Send Telegram message error to {tg_id}: {err}\n{text}')
@@ -4,7 +4,7 @@ from decimal import Decimal
 from random import randint
 from loguru import logger
 from time import sleep
-from web3 import Web3
+from eth_account import Account
 from tqdm import tqdm
 import asyncio
 import string
@@ -104,7 +104,7 @@ def format_password(password: str):
 
 
 def get_address(pk: str):
-    return Web3().eth.account.from_key(pk).address
+    return Account.from_key(pk).address
 
 
 def parse_cookies(cookies: str, key: str):
@@ -40,3 +40,31 @@ class WindowName:
         self.modules_done = 0
         self.modules_amount = modules_amount
         self.update_name()
+
+
+class SharedWindowName(WindowName):
+    def __init__(self, accs_amount: int, counters):
+        # counters is a multiprocessing.Array of [accs_done, modules_done] shared with the main process
+        self.counters = counters
+        self.accs_amount = accs_amount
+        self.modules_amount = 0
+
+    @property
+    def accs_done(self): return self.counters[0]
+
+    @property
+    def modules_done(self): return self.counters[1]
+
+    def update_name(self):
+        pass
+
+    def add_acc(self):
+        with self.counters.get_lock():
+            self.counters[0] += 1
+
+    def add_module(self, modules_done=1):
+        with self.counters.get_lock():
+            self.counters[1] += modules_done
+
+    def set_modules(self, modules_amount: int):
+        self.modules_amount = modules_amount
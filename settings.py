@@ -75,6 +75,53 @@ SLEEP_BETWEEN_CLOSE_ORDERS = [0, 0]                     # задержка ме
 
 # --- GENERAL SETTINGS ---
 THREADS             = 1                                 # количество потоков (одновременно работающих кошельков)
+PROCESSES           = 1                                 # количество процессов. больше 1 - аккаунты делятся между процессами,
+                                                        # в каждом по THREADS потоков (только для DATABASE_ENGINE = "sqlite", кроме Pairs Mode)
+DATABASE_ENGINE     = "sqlite"                          # "sqlite" - хранить базу в databases/modules.sqlite3 (старый modules.json импортируется автоматически)
+                                                        # "json" - хранить базу в databases/modules.json как раньше
+DATABASE_CHECKPOINT = {                                 # изменения базы держатся в памяти и пишутся в журнал databases/modules.*.wal...
+    "seconds"       : 30,                               # ...а в саму базу сохраняются раз в 30 секунд
+    "changes"       : 50,                               # ...или после 50 измененных аккаунтов
+}
+DATABASE_LEASES     = {                                 # общая очередь модулей для нескольких процессов/серверов на одной modules.sqlite3
+    "enabled"       : False,                            # True - поток берет модуль из базы в аренду (только для DATABASE_ENGINE = "sqlite")...
+    "seconds"       : 120,                              # ...на 120 секунд и продлевает ее, пока модуль работает. если процесс упал - модуль вернется в очередь
+}
+                                                        # с арендой база работает без WAL (journal_mode=DELETE): WAL не работает с сетевого диска.
+                                                        # диск должен поддерживать блокировки файлов, на всех серверах "enabled" должно быть True
+SESSION_TOKEN_HOURS = 12                                # сколько часов использовать сохраненный токен авторизации аккаунта (между модулями и перезапусками)
+                                                        # 0 - логиниться заново в каждом модуле
+ACCOUNT_INFO_HOURS  = 168                               # сколько часов доверять сохраненным данным аккаунта (регистрация, прокси кошелек, апрув)
+                                                        # 0 - проверять в каждом модуле. при ошибке ордера из-за них данные проверятся заново
+BALANCE_SECONDS     = 60                                # сколько секунд использовать баланс, полученный при логине, вместо нового запроса
+                                                        # после каждого ордера баланс запрашивается заново
+CONNECTION_POOL     = {                                 # соединения переиспользуются между аккаунтами (на каждый прокси свой пул)
+    "limit"         : 100,                              # максимум открытых соединений в одном пуле
+    "limit_per_host": 30,                               # максимум соединений к одному сайту в одном пуле
+    "keepalive"     : 30,                               # сколько секунд держать неиспользуемое соединение открытым
+    "dns_cache"     : 300,                              # сколько секунд кешировать DNS
+}
+BOOK_CACHE          = {                                 # стаканы общие для всех аккаунтов процесса, одновременные запросы одного стакана объединяются
+    "seconds"       : 1,                                # сколько секунд использовать полученный стакан | 0 - только объединять одновременные запросы
+    "size"          : 500,                              # сколько стаканов держать в памяти
+}
+TOPIC_CACHE         = {                                 # данные событий (названия, исходы, токены) общие для всех аккаунтов процесса
+    "seconds"       : 300,                              # сколько секунд использовать полученные данные события, цены всегда берутся из стакана
+    "size"          : 200,                              # сколько событий держать в памяти
+}
+ORDER_WATCHER       = {                                 # статусы всех ордеров аккаунта проверяются одним запросом
+    "fast"          : 1,                                # проверять раз в 1 секунду...
+    "fast_seconds"  : 5,                                # ...первые 5 секунд после выставления ордера
+    "slow"          : 5,                                # потом раз в 5 секунд (лимитки, которые стоят в стакане)
+}
+MARKET_SCANNER      = {                                 # когда LIST и SINGLE_BUY пустые - события ищутся в фоне, аккаунты берут готовые
+    "seconds"       : 60,                               # обновлять список подходящих событий раз в 60 секунд
+    "retry"         : 5,                                # если подходящих событий нет или загрузка упала - повторить через 5 секунд
+    "failures"      : 3,                                # после 3 неудачных загрузок подряд сканер переключается на другой прокси из proxies.txt
+    "topics"        : 30,                               # сколько событий загружать со страницы
+    "threads"       : 10,                               # сколько стаканов загружать одновременно
+    "top"           : 3,                                # выбирать рандомное событие из 3 лучших по спреду
+}
 
 
 # --- PERSONAL SETTINGS ---
@@ -0,0 +1,5 @@
+from pathlib import Path
+import sys
+
+# modules import settings.py from the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
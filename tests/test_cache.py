@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+
+from modules.utils import AsyncTTLCache
+
+
+def make_loader(calls: list, value="book", delay: float = 0.01, error: Exception = None):
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return value
+    return loader
+
+
+def test_hit_after_load():
+    async def run():
+        cache, calls = AsyncTTLCache(ttl=60), []
+        assert await cache.get("key", make_loader(calls)) == "book"
+        assert await cache.get("key", make_loader(calls)) == "book"
+        return cache, calls
+
+    cache, calls = asyncio.run(run())
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_concurrent_gets_share_one_load():
+    async def run():
+        cache, calls = AsyncTTLCache(ttl=60), []
+        results = await asyncio.gather(*[cache.get("key", make_loader(calls)) for _ in range(10)])
+        return cache, calls, results
+
+    cache, calls, results = asyncio.run(run())
+    assert results == ["book"] * 10
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 9
+
+
+def test_expired_value_is_loaded_again():
+    async def run():
+        cache, calls = AsyncTTLCache(ttl=0.02), []
+        await cache.get("key", make_loader(calls))
+        await asyncio.sleep(0.05)
+        await cache.get("key", make_loader(calls))
+        return calls
+
+    assert len(asyncio.run(run())) == 2
+
+
+def test_failed_load_is_not_cached():
+    async def run():
+        cache, calls = AsyncTTLCache(ttl=60), []
+        results = await asyncio.gather(
+            *[cache.get("key", make_loader(calls, error=ValueError("no book"))) for _ in range(3)],
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+        assert await cache.get("key", make_loader(calls)) == "book"
+        return calls
+
+    assert len(asyncio.run(run())) == 2
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    async def run():
+        cache, calls = AsyncTTLCache(ttl=60), []
+        first = asyncio.create_task(cache.get("key", make_loader(calls, delay=0.05)))
+        second = asyncio.create_task(cache.get("key", make_loader(calls, delay=0.05)))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second, calls
+
+    value, calls = asyncio.run(run())
+    assert value == "book" and len(calls) == 1
+
+
+def test_least_recently_used_is_evicted():
+    async def run():
+        cache, calls = AsyncTTLCache(ttl=60, max_size=2), []
+        for key in ["a", "b", "a", "c"]:
+            await cache.get(key, make_loader(calls, value=key))
+        return cache
+
+    cache = asyncio.run(run())
+    assert len(cache) == 2
+    assert list(cache.values) == ["a", "c"]
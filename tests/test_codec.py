@@ -0,0 +1,63 @@
+from typing import TypedDict
+import importlib
+import sys
+import pytest
+
+from modules.utils import codec
+
+
+class Item(TypedDict, total=False):
+    price: str
+    amount: float
+
+
+BACKENDS = {
+    "msgspec": [],
+    "orjson": ["msgspec"],
+    "json": ["msgspec", "orjson"],
+}
+
+
+@pytest.fixture(params=list(BACKENDS))
+def backend_codec(request, monkeypatch):
+    for module_name in BACKENDS[request.param]:
+        # None in sys.modules makes `import` raise ImportError
+        monkeypatch.setitem(sys.modules, module_name, None)
+    try:
+        loaded = importlib.reload(codec)
+    except ImportError:
+        pytest.skip(f'{request.param} is not installed')
+    if loaded.BACKEND != request.param:
+        pytest.skip(f'{request.param} is not installed')
+
+    yield loaded
+    monkeypatch.undo()
+    importlib.reload(codec)
+
+
+def test_roundtrip(backend_codec):
+    data = {"key": "значение", "list": [1, 2.5, None, True], "nested": {"a": []}}
+
+    encoded = backend_codec.encode(data)
+    assert isinstance(encoded, bytes)
+    assert backend_codec.loads(encoded) == data
+    assert backend_codec.loads(backend_codec.dumps(data)) == data
+
+
+def test_typed_decode_returns_plain_dicts(backend_codec):
+    body = b'[{"price": "0.5", "amount": 1.5, "unused": {"deep": 1}}]'
+
+    decoded = backend_codec.loads(body, type=list[Item])
+    assert isinstance(decoded[0], dict)
+    assert decoded[0]["price"] == "0.5" and decoded[0]["amount"] == 1.5
+
+
+def test_typed_decode_falls_back_on_changed_shape(backend_codec):
+    body = b'[{"price": 0.5, "amount": "many"}]'
+
+    assert backend_codec.loads(body, type=list[Item]) == [{"price": 0.5, "amount": "many"}]
+
+
+def test_bad_json_raises_value_error(backend_codec):
+    with pytest.raises(ValueError):
+        backend_codec.loads(b'{"cut off": ')
@@ -0,0 +1,62 @@
+from collections import Counter
+import asyncio
+import pytest
+
+from modules.tasks import Account, ModuleTask, ModulesQueue, TaskScheduler
+
+
+def make_account(index: int):
+    return Account(encoded_privatekey=f"key{index}", address=f"0x{index:040x}", proxy=None, label=f"acc{index}")
+
+
+def make_queue(accounts_amount: int, module_names: list[str]):
+    queue = ModulesQueue()
+    for index in range(accounts_amount):
+        queue.add_account(make_account(index), module_names)
+    return queue
+
+
+def test_queue_yields_every_module_in_order():
+    queue = make_queue(3, ["opinion", "opinion", "sell"])
+
+    tasks = list(queue)
+    assert len(queue) == 9
+    assert [(task.address, task.module_name) for task in tasks[:3]] == [
+        (f"0x{0:040x}", "opinion"),
+        (f"0x{0:040x}", "opinion"),
+        (f"0x{0:040x}", "sell"),
+    ]
+    assert all(isinstance(task, ModuleTask) and task.status == "to_run" for task in tasks)
+    # tasks of one wallet share one account record
+    assert tasks[0].account is tasks[2].account
+
+
+def test_queue_shuffle_keeps_modules():
+    queue = make_queue(50, ["opinion", "sell"])
+    before = Counter((task.encoded_privatekey, task.module_name) for task in queue)
+
+    queue.shuffle()
+
+    assert Counter((task.encoded_privatekey, task.module_name) for task in queue) == before
+
+
+def test_queue_limits_module_names():
+    queue = ModulesQueue()
+    with pytest.raises(ValueError):
+        queue.add_account(make_account(0), [f"module{index}" for index in range(ModulesQueue.NAMES_LIMIT + 1)])
+
+
+def test_scheduler_never_runs_one_address_twice_at_once():
+    queue = make_queue(3, ["opinion"] * 4)
+    running = Counter()
+    done = []
+
+    async def worker(task: ModuleTask):
+        running[task.address] += 1
+        assert running[task.address] == 1
+        await asyncio.sleep(0.001)
+        running[task.address] -= 1
+        done.append(task)
+
+    asyncio.run(TaskScheduler(queue).run(worker=worker, workers_amount=5))
+    assert len(done) == 12